@@ -1 +1,3 @@
-from .main import on, Qjoin
+from .columnar import columns, QjoinColumns, QjoinRow
+from .join_index import load_index, QjoinIndex, QjoinMappedIndex
+from .main import on, index, Qjoin
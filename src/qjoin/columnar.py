@@ -0,0 +1,101 @@
+import collections.abc
+from typing import Any, Dict, Hashable, Iterator, Mapping, Sequence
+
+
+class QjoinColumns:
+    """
+    Collection stored column by column, see ``qjoin.columns``.
+
+    Iterating the collection yields ``QjoinRow`` views that read the columns at their position, no row is copied.
+    """
+
+    def __init__(self, columns: Mapping[str, Sequence[Any]]):
+        lengths = {name: len(column) for name, column in columns.items()}
+        if len(set(lengths.values())) > 1:
+            raise ValueError(f'all the columns of a qjoin columns collection must have the same length: {lengths}.')
+
+        self._columns = dict(columns)
+        self._length = next(iter(lengths.values()), 0)
+
+    def __iter__(self) -> Iterator['QjoinRow']:
+        for position in range(self._length):
+            yield QjoinRow(self, position)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def column(self, name: str) -> Sequence[Any]:
+        return self._columns[name]
+
+    def row(self, position: int) -> 'QjoinRow':
+        return QjoinRow(self, position)
+
+    def index(self, name: str) -> '_ColumnIndex':
+        """
+        Indexes the collection on a column. Each value gives the first row that has this value in the column.
+        """
+        positions: Dict[Hashable, int] = {}
+        for position, value in enumerate(self._columns[name]):
+            positions.setdefault(value, position)
+
+        return _ColumnIndex(self, positions)
+
+
+class QjoinRow(collections.abc.Mapping):
+    """
+    Read only view on a row of a ``QjoinColumns`` collection. It behaves like a dictionary whose keys are the names
+    of the columns.
+    """
+    __slots__ = ('_collection', '_position')
+
+    def __init__(self, collection: QjoinColumns, position: int):
+        self._collection = collection
+        self._position = position
+
+    def __getitem__(self, name: str) -> Any:
+        return self._collection.column(name)[self._position]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._collection._columns)
+
+    def __len__(self) -> int:
+        return len(self._collection._columns)
+
+    def __repr__(self) -> str:
+        return f'QjoinRow({dict(self)!r})'
+
+
+class _ColumnIndex:
+    """
+    Index of a ``QjoinColumns`` collection on a column, the row view is only created when a lookup finds a row.
+    """
+
+    def __init__(self, collection: QjoinColumns, positions: Dict[Hashable, int]):
+        self._collection = collection
+        self._positions = positions
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        position = self._positions.get(key)
+        if position is None:
+            return default
+
+        return QjoinRow(self._collection, position)
+
+
+def columns(data: Mapping[str, Sequence[Any]]) -> QjoinColumns:
+    """
+    Creates a collection from data stored column by column, like a dictionary of lists, of ``array.array``
+    or of numpy arrays. Every column must have the same length.
+
+    The collection can be used as a base collection or as a join collection without creating a dictionary per row.
+    A join on the name of a column indexes and reads the column directly.
+
+    >>> spacecraft_properties = qjoin.columns({
+    >>>     'name': ['Kepler', 'GRAIL (A)', 'InSight', 'lucy'],
+    >>>     'power': array.array('i', [1100, 0, 600, 504]),
+    >>> })
+    >>>
+    >>> for spacecraft, spacecraft_property in qjoin.on(spacecrafts).join(spacecraft_properties, key='name'):
+    >>>     print(spacecraft['name'], spacecraft_property['power'] if spacecraft_property else None)
+    """
+    return QjoinColumns(data)
@@ -0,0 +1,247 @@
+import bisect
+import hashlib
+import inspect
+import json
+import mmap
+import os
+import pickle
+import struct
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Tuple, Union, cast
+
+_MAGIC = b'QJOINIDX'
+_VERSION = 1
+_PREAMBLE = struct.Struct('<8sII')
+_ENTRY = struct.Struct('<QQQ')
+_LENGTH = struct.Struct('<Q')
+
+
+class QjoinIndex:
+    """
+    Index of a join collection, each key gives the first element of the collection that has this key.
+
+    This is the structure built behind ``Qjoin.join``. An index can be used as a join collection and saved to a file
+    to be reopened with ``qjoin.load_index``.
+    """
+
+    def __init__(self, key_spec: Optional[str], elements: Dict[Hashable, Any]):
+        self.key_spec = key_spec
+        self._elements = elements
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._elements.values())
+
+    def __len__(self) -> int:
+        return len(self._elements)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        return self._elements.get(key, default)
+
+    def save(self, path: str, fingerprint: str = '') -> None:
+        """
+        Writes the index to a file.
+
+        ``fingerprint`` identifies the source from which the index has been built, for example the size and the modification
+        time of a file. It is checked by ``qjoin.load_index`` to detect a stale index.
+
+        Only keys made of None, bool, int, float, str, bytes and tuples of them can be saved, a ValueError is raised
+        for other keys. An index built on a callable that is not a module level function, like a lambda, must be given
+        a ``spec`` by ``qjoin.index`` to be saved.
+
+        >>> qjoin.index(spacecraft_properties, key='name').save('spacecraft_properties.idx', fingerprint='v42')
+        """
+        if self.key_spec is None:
+            raise ValueError('the key of the index is a callable that cannot be recorded in a file, build the index with a spec: qjoin.index(collection, key=..., spec="mykey").')
+
+        records = []
+        for key, element in self._elements.items():
+            records.append((_digest(key), pickle.dumps((key, element), protocol=pickle.HIGHEST_PROTOCOL)))
+
+        records.sort(key=lambda record: record[0])
+
+        header = json.dumps({'key': self.key_spec, 'fingerprint': fingerprint, 'count': len(records)}).encode('utf-8')
+        offset = _PREAMBLE.size + len(header) + _ENTRY.size * len(records)
+
+        temporary_path = f'{path}.tmp'
+        with open(temporary_path, 'wb') as file:
+            file.write(_PREAMBLE.pack(_MAGIC, _VERSION, len(header)))
+            file.write(header)
+            for digest, record in records:
+                file.write(_ENTRY.pack(digest, offset, len(record)))
+                offset += len(record)
+
+            for _, record in records:
+                file.write(record)
+
+        os.replace(temporary_path, path)
+
+
+class QjoinMappedIndex:
+    """
+    Index of a join collection read from a file written by ``QjoinIndex.save``.
+
+    The file is memory mapped, only the pages read by a lookup are loaded and they are shared between the processes
+    that open the same file. It can be used as a join collection like ``QjoinIndex``.
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, header_size = _PREAMBLE.unpack_from(self._mmap, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self._mmap.close()
+            raise ValueError(f'{path} is not a qjoin index file of version {_VERSION}.')
+
+        header = json.loads(self._mmap[_PREAMBLE.size:_PREAMBLE.size + header_size].decode('utf-8'))
+        self.key_spec: str = header['key']
+        self.fingerprint: str = header['fingerprint']
+        self._count: int = header['count']
+        self._entries = _Entries(self._mmap, _PREAMBLE.size + header_size, self._count)
+
+    def __enter__(self) -> 'QjoinMappedIndex':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def __iter__(self) -> Iterator[Any]:
+        for position in range(self._count):
+            _, element = self._record(position)
+            yield element
+
+    def __len__(self) -> int:
+        return self._count
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            digest = _digest(key)
+        except ValueError:
+            return default
+
+        position = bisect.bisect_left(self._entries, digest, 0, self._count)
+        while position < self._count and self._entries[position] == digest:
+            record_key, element = self._record(position)
+            if record_key == key:
+                return element
+
+            position += 1
+
+        return default
+
+    def close(self) -> None:
+        self._mmap.close()
+
+    def _record(self, position: int) -> Tuple[Hashable, Any]:
+        _, offset, size = self._entries.entry(position)
+        return pickle.loads(self._mmap[offset:offset + size])
+
+
+class _Entries:
+    """
+    Table of the entries of an index file, seen as a sorted sequence of digests to be searched with bisect.
+    """
+
+    def __init__(self, buffer: mmap.mmap, offset: int, count: int):
+        self._buffer = buffer
+        self._offset = offset
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, position: int) -> int:
+        return self.entry(position)[0]
+
+    def entry(self, position: int) -> Tuple[int, int, int]:
+        return cast(Tuple[int, int, int], _ENTRY.unpack_from(self._buffer, self._offset + position * _ENTRY.size))
+
+
+def load_index(path: str,
+               key: Optional[Union[int, str, Callable[[Any], Hashable]]] = None,
+               spec: Optional[str] = None,
+               fingerprint: Optional[str] = None) -> QjoinMappedIndex:
+    """
+    Opens an index file written by ``QjoinIndex.save``.
+
+    When ``key`` or ``fingerprint`` are given, they are compared to the ones recorded in the file and a ValueError is
+    raised if the index is stale. Only a module level function can be compared by name, the ``spec`` given
+    to ``qjoin.index`` is used instead.
+
+    >>> spacecraft_properties = qjoin.load_index('spacecraft_properties.idx', key='name', fingerprint='v42')
+    >>> qjoin.on(spacecrafts).join(spacecraft_properties, key='name').all()
+
+    The keys and the elements are read with ``pickle``, which can run arbitrary code: only load index files
+    from a trusted source.
+    """
+    if key is not None and spec is not None:
+        raise ValueError('key and spec parameters must not be used together.')
+
+    expected_spec = spec
+    if key is not None:
+        expected_spec = key_spec(key)
+        if expected_spec is None:
+            raise ValueError('only a module level function can be compared to the key recorded in an index file, use spec parameter instead.')
+
+    index = QjoinMappedIndex(path)
+    if expected_spec is not None and expected_spec != index.key_spec:
+        index.close()
+        raise ValueError(f'{path} index is built on key {index.key_spec}, not on {expected_spec}.')
+
+    if fingerprint is not None and fingerprint != index.fingerprint:
+        index.close()
+        raise ValueError(f'{path} index is stale, it has been built from source {index.fingerprint!r}, not from {fingerprint!r}.')
+
+    return index
+
+
+def key_spec(key: Union[int, str, Callable[..., Any]]) -> Optional[str]:
+    """
+    Describes a join key so that it can be recorded in an index file. A function is described by its qualified name.
+    Other callables, like a lambda, a local function, ``operator.itemgetter`` or ``functools.partial``, have no
+    description: their name does not tell them apart.
+    """
+    if callable(key):
+        if not inspect.isfunction(key) or '<' in key.__qualname__:
+            return None
+
+        return f'function:{key.__module__}.{key.__qualname__}'
+
+    return f'{type(key).__name__}:{key}'
+
+
+def _digest(key: Hashable) -> int:
+    """
+    Hash of a key that is the same in every process, unlike ``hash`` on strings. Equal keys have the same digest.
+    """
+    data = _canonical_key(key)
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+
+def _canonical_key(key: Hashable) -> bytes:
+    """
+    Encodes a key so that equal keys give the same bytes, as they would give the same dictionary entry:
+    ``1``, ``1.0`` and ``True`` share an encoding. Raises ValueError for a key that has no canonical encoding.
+    """
+    if key is None:
+        return b'n'
+
+    if isinstance(key, float) and key.is_integer():
+        key = int(key)
+
+    if isinstance(key, int):
+        return b'i' + str(int(key)).encode('ascii') + b';'
+
+    if isinstance(key, float):
+        return b'f' + repr(key).encode('ascii') + b';'
+
+    if isinstance(key, str):
+        data = key.encode('utf-8', 'surrogatepass')
+        return b's' + _LENGTH.pack(len(data)) + data
+
+    if isinstance(key, bytes):
+        return b'b' + _LENGTH.pack(len(key)) + key
+
+    if isinstance(key, tuple):
+        return b't' + _LENGTH.pack(len(key)) + b''.join(_canonical_key(item) for item in key)
+
+    raise ValueError(f'key {key!r} of type {type(key).__name__} cannot be stored in a qjoin index file, only None, bool, int, float, str, bytes and tuples of them can.')
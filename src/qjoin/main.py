@@ -1,11 +1,29 @@
+import asyncio
+import bisect
+import collections
+import collections.abc
+import concurrent.futures
 import dataclasses
-from typing import Iterable, Any, Tuple, List, Union, Callable, Hashable, Optional, Type, TypeVar
+import functools
+import heapq
+import inspect
+import math
+import operator
+import queue
+import threading
+import time
+from typing import Iterable, Any, Tuple, List, Union, Callable, Hashable, Optional, Type, TypeVar, Dict, Iterator, Deque, Set, NamedTuple, Mapping, cast
 
 import qjoin
 from qjoin import logger
+from qjoin.columnar import QjoinColumns, _ColumnIndex
+from qjoin.join_index import QjoinIndex, QjoinMappedIndex, key_spec
 
 T = TypeVar('T')
 
+_NO_MATCH = object()
+_END_OF_STREAM = object()
+
 
 @dataclasses.dataclass
 class QjoinJoin:
@@ -16,76 +34,147 @@ class QjoinJoin:
     key: Optional[Union[int, str, Callable[[Any], Hashable]]] = None
     left: Optional[Union[int, str, Callable[[Any], Hashable]]] = None
     right: Optional[Union[int, str, Callable[[Any], Hashable]]] = None
+    key_batch: Optional[Callable[[List[Any]], List[Hashable]]] = None
+    left_batch: Optional[Callable[[List[Any]], List[Hashable]]] = None
+    right_batch: Optional[Callable[[List[Any]], List[Hashable]]] = None
+    distinct: Optional['QjoinDistinct'] = None
+
+
+@dataclasses.dataclass
+class QjoinFilter:
+    """
+    Definition of a semi join (``exists``) or an anti join (``not_exists``) in qjoin. The filter keeps or drops
+    the elements of the base collection depending on the presence of their key in the collection.
+    """
+    collection: Iterable[Any]
+    key: Optional[Union[int, str, Callable[[Any], Hashable]]] = None
+    left: Optional[Union[int, str, Callable[[Any], Hashable]]] = None
+    right: Optional[Union[int, str, Callable[[Any], Hashable]]] = None
+    negate: bool = False
+
+
+@dataclasses.dataclass
+class QjoinRangeJoin:
+    """
+    Definition of a range join in qjoin. An element of the base collection matches an element of the collection
+    when its value is contained in the interval [start, end) of this element.
+    """
+    collection: Iterable[Any]
+    value: Union[int, str, Callable[[Any], Any]]
+    start: Union[int, str, Callable[[Any], Any]]
+    end: Union[int, str, Callable[[Any], Any]]
+    distinct: Optional['QjoinDistinct'] = None
+
+
+@dataclasses.dataclass
+class QjoinAsofJoin:
+    """
+    Definition of an as-of join in qjoin. An element of the base collection matches the element of the collection
+    with the greatest ``on`` key lower or equal to its own key, in the same ``by`` group.
+    """
+    collection: Iterable[Any]
+    on: Union[int, str, Callable[[Any], Any]]
+    by: Optional[Union[int, str, Callable[[Any], Hashable]]] = None
+    tolerance: Optional[Any] = None
+    distinct: Optional['QjoinDistinct'] = None
+
+
+@dataclasses.dataclass
+class QjoinLookupJoin:
+    """
+    Definition of a lookup join in qjoin. The elements to join are not in a collection, they are fetched by key
+    with a function that takes a list of keys. ``cache`` keeps the last fetched elements between the iterations of the query.
+    """
+    fetch_many: Callable[[List[Hashable]], Any]
+    left: Union[int, str, Callable[[Any], Hashable]]
+    batch_size: int = 100
+    concurrency: int = 1
+    cache_size: int = 10000
+    cache: 'collections.OrderedDict[Hashable, Any]' = dataclasses.field(default_factory=collections.OrderedDict)
+    distinct: Optional['QjoinDistinct'] = None
+
+
+@dataclasses.dataclass
+class QjoinDistinct:
+    """
+    Definition of the deduplication of a collection in qjoin. Only one element is kept per key, the first or the last one.
+    With a false positive rate, the keys already seen are kept in a bloom filter instead of a set.
+    """
+    key: Union[int, str, Callable[[Any], Hashable]]
+    keep: str = 'first'
+    false_positive_rate: Optional[float] = None
+    capacity: Optional[int] = None
 
 
 class Qjoin:
 
     def __init__(self, collection: Iterable[Any]):
         self._base_collection = collection
-        self.join_definitions: List['QjoinJoin'] = []
+        self.join_definitions: List[Union['QjoinJoin', 'QjoinRangeJoin', 'QjoinAsofJoin', 'QjoinLookupJoin']] = []
+        self.filter_definitions: List['QjoinFilter'] = []
+        self._base_distinct: Optional['QjoinDistinct'] = None
 
     def __iter__(self):
-        predicates = []
-        if _is_collection_empty(self._base_collection):
-            return []
+        base_collection = _materialize(self._base_collection)
+        if _is_collection_empty(base_collection):
+            return iter(())
+
+        if any(_join_batch_keys(join_definition)[0] is not None or isinstance(join_definition, QjoinLookupJoin) for join_definition in self.join_definitions):
+            base_collection = list(base_collection)
+
+        keep_distinct = None
+        if self._base_distinct is not None:
+            keep_distinct = _distinct_keep(base_collection, self._base_distinct, _key_getter(base_collection, self._base_distinct.key))
 
+        filters = []
+        for filter_definition in self.filter_definitions:
+            filter_definition = dataclasses.replace(filter_definition, collection=_materialize(filter_definition.collection))
+            filters.append(_filter_predicate(base_collection, filter_definition))
+
+        if any(isinstance(join_definition, QjoinLookupJoin) for join_definition in self.join_definitions):
+            # the keys of a lookup join are fetched before the loop, only the elements kept by distinct and the filters are read
+            base_collection = [element for position, element in enumerate(base_collection)
+                               if (keep_distinct is None or keep_distinct(position, element)) and all(keep(element) for keep in filters)]
+            keep_distinct = None
+            filters = []
+            if not base_collection:
+                return iter(())
+
+        probes = []
         for join_definition in self.join_definitions:
-            is_key_used = join_definition.key is not None
-            is_key_subscription = join_definition.key is not None and (isinstance(join_definition.key, str) or isinstance(join_definition.key, int))
-            is_key_func = join_definition.key is not None and callable(join_definition.key)
-            is_left_right_used = join_definition.key is None and join_definition.left is not None and join_definition.right is not None
-            is_left_subscription = join_definition.left is not None and (isinstance(join_definition.left, str) or isinstance(join_definition.left, int))
-            is_left_func = join_definition.left is not None and callable(join_definition.left)
-            is_right_subscription = join_definition.right is not None and (isinstance(join_definition.right, str) or isinstance(join_definition.right, int))
-            is_right_func = join_definition.right is not None and callable(join_definition.right)
-
-            if _is_collection_subscriptable(self._base_collection):
-                get_elt_left = lambda elt, key: elt[key]
-            else:
-                get_elt_left = lambda elt, key: getattr(elt, key)
+            if not isinstance(join_definition, QjoinLookupJoin):
+                join_definition = dataclasses.replace(join_definition, collection=_materialize(join_definition.collection))
+
+            if join_definition.distinct is not None:
+                join_definition = dataclasses.replace(join_definition, collection=_distinct_collection(join_definition.collection, join_definition.distinct))
 
-            if _is_collection_empty(join_definition.collection):
-                get_elt_right = lambda elt, key: None
-            elif _is_collection_subscriptable(join_definition.collection):
-                get_elt_right = lambda elt, key: elt[key]
+            if isinstance(join_definition, QjoinRangeJoin):
+                probes.append(_range_probe(base_collection, join_definition))
+            elif isinstance(join_definition, QjoinAsofJoin):
+                probes.append(_asof_probe(base_collection, join_definition))
+            elif isinstance(join_definition, QjoinLookupJoin):
+                probes.append(_lookup_probe(base_collection, join_definition))
             else:
-                get_elt_right = lambda elt, key: getattr(elt, key)
-
-            predicate = lambda elt_left, elt_right: False
-            if is_key_used and is_key_subscription:
-                predicate = lambda elt_left, elt_right: get_elt_left(elt_left, join_definition.key) == get_elt_right(elt_right, join_definition.key)
-            elif is_key_used and is_key_func:
-                predicate = lambda elt_left, elt_right: join_definition.key(elt_left) == join_definition.key(elt_right)
-            elif is_left_right_used and is_left_subscription is True and is_right_subscription is True:
-                predicate = lambda elt_left, elt_right: get_elt_left(elt_left, join_definition.left) == get_elt_right(elt_right, join_definition.right)
-            elif is_left_right_used and is_left_func is True and is_right_subscription is True:
-                predicate = lambda elt_left, elt_right: join_definition.left(elt_left) == get_elt_right(elt_right, join_definition.right)
-            elif is_left_right_used and is_left_subscription is True and is_right_func is True:
-                predicate = lambda elt_left, elt_right: get_elt_left(elt_left, join_definition.left) == join_definition.right(elt_right)
-            elif is_left_right_used and is_left_func is True and is_right_func is True:
-                predicate = lambda elt_left, elt_right: join_definition.left(elt_left) == join_definition.right(elt_right)
-
-            predicates.append(predicate)
-
-        for element in self._base_collection:
-            result = [element]
-            for join_definition_index, join_definition in enumerate(self.join_definitions):
-                join_match = False
-                for element_to_join in join_definition.collection:
-                    predicate = predicates[join_definition_index]
-                    if predicate(element, element_to_join):
-                        result.append(element_to_join)
-                        join_match = True
-                        break
-                if join_match is False:
-                    result.append(None)
-
-            yield tuple(result)
+                probes.append(_hash_probe(base_collection, join_definition))
+
+        iterator = _compile_iterator(keep_distinct is not None, len(filters), tuple(probe.kind for probe in probes))
+        arguments: List[Any] = [base_collection]
+        if keep_distinct is not None:
+            arguments.append(keep_distinct)
+
+        arguments.extend(filters)
+        for probe in probes:
+            arguments.extend((probe.lookup, probe.extract))
+
+        return iterator(*arguments)
 
     def join(self, collection: Iterable[Any],
              key: Optional[Union[int, str, Callable[[Any], Hashable]]] = None,
              left: Optional[Union[int, str, Callable[[Any], Hashable]]] = None,
-             right: Optional[Union[int, str, Callable[[Any], Hashable]]] = None) -> 'Qjoin':
+             right: Optional[Union[int, str, Callable[[Any], Hashable]]] = None,
+             key_batch: Optional[Callable[[List[Any]], List[Hashable]]] = None,
+             left_batch: Optional[Callable[[List[Any]], List[Hashable]]] = None,
+             right_batch: Optional[Callable[[List[Any]], List[Hashable]]] = None) -> 'Qjoin':
         """
         Performs a join in a qjoin query with the base collection.
 
@@ -145,22 +234,230 @@ class Qjoin:
         >>> ]
         >>> global_spacecrafts = qjoin.on(spacecrafts).join(spacecrafts_properties, left=lambda s: s['name'].lower(), right='spacecraft')
 
+        The collection may also be an index built with ``qjoin.index`` or loaded with ``qjoin.load_index``. The key of
+        the base collection is given with ``key`` or ``left``, the key of the index is the one it has been built on.
+
+        >>> spacecraft_properties_index = qjoin.load_index('spacecraft_properties.idx', key='name')
+        >>> global_spacecrafts = qjoin.on(spacecrafts).join(spacecraft_properties_index, left='name')
+
+        When computing a key is expensive, ``key_batch``, ``left_batch`` and ``right_batch`` replace ``key``, ``left`` and
+        ``right`` with a function that takes the list of all the elements of a collection and returns the list of their keys,
+        in the same order. The keys of each collection are then computed once, in a single call.
+
+        >>> def normalize_names(spacecrafts):
+        >>>     return [unicodedata.normalize('NFKC', s['name']).casefold() for s in spacecrafts]
+        >>>
+        >>> global_spacecrafts = qjoin.on(spacecrafts).join(spacecrafts_properties, key_batch=normalize_names)
+
         The join function is lazy. Until a render function is called like .all or a loop is used on the QJoin instance,
         the join is just declared.
         """
-        if key is None and left is None and right is None:
-            raise ValueError('A key has to be specified when using join in qjoin query. qjoin.join(key="mykey") or qjoin.join(key=lambda x: x.mykey)')
+        if key is not None and key_batch is not None:
+            raise ValueError('key and key_batch parameters must not be used together.')
+
+        if left is not None and left_batch is not None:
+            raise ValueError('left and left_batch parameters must not be used together.')
+
+        if right is not None and right_batch is not None:
+            raise ValueError('right and right_batch parameters must not be used together.')
 
-        if key is not None and (left is not None or right is not None):
-            raise ValueError('key parameter should be used alone, it must not be used with left or right parameters.')
+        if isinstance(collection, (QjoinIndex, QjoinMappedIndex)):
+            if key_batch is not None or right_batch is not None:
+                raise ValueError('key_batch and right_batch parameters cannot be used when joining on an index, the keys of the index are already computed.')
 
-        if left is not None and right is None:
-            raise ValueError('A right key parameter has to be specified when using join in qjoin query and left. qjoin.join(left="any", right="mykey") or qjoin.join(left=lambda x: x.mykey, right=lambda x: x.mykey2)')
+            _check_index_keys(collection, key, _first_defined(left, left_batch), right)
+        else:
+            _check_join_keys('join', _first_defined(key, key_batch), _first_defined(left, left_batch), _first_defined(right, right_batch))
 
-        join = QjoinJoin(collection, key=key, left=left, right=right)
+        join = QjoinJoin(collection, key=key, left=left, right=right, key_batch=key_batch, left_batch=left_batch, right_batch=right_batch)
         self.join_definitions.append(join)
         return self
 
+    def join_range(self, collection: Iterable[Any],
+                   value: Union[int, str, Callable[[Any], Any]],
+                   start: Union[int, str, Callable[[Any], Any]],
+                   end: Union[int, str, Callable[[Any], Any]]) -> 'Qjoin':
+        """
+        Performs a range join in a qjoin query with the base collection.
+
+        An element of the base collection is joined with the first element of the collection, in the order of the collection,
+        whose interval [start, end) contains its value. ``value`` is read on the elements of the base collection,
+        ``start`` and ``end`` on the elements of the collection. They can either be the name of a field or a function.
+
+        >>> observations = [
+        >>>    {'spacecraft': 'Kepler', 'date': '2012-07-16'},
+        >>>    {'spacecraft': 'Kepler', 'date': '2013-06-01'},
+        >>> ]
+        >>>
+        >>> mission_phases = [
+        >>>    {'phase': 'primary mission', 'from': '2009-03-07', 'to': '2012-11-14'},
+        >>>    {'phase': 'extended mission', 'from': '2012-11-14', 'to': '2013-05-15'},
+        >>> ]
+        >>>
+        >>> for observation, mission_phase in qjoin.on(observations).join_range(mission_phases, value='date', start='from', end='to'):
+        >>>     print(observation['date'], mission_phase['phase'] if mission_phase else None)
+
+        The intervals are indexed once when the query is iterated, each element of the base collection is then
+        matched with a binary search.
+        """
+        join = QjoinRangeJoin(collection, value=value, start=start, end=end)
+        self.join_definitions.append(join)
+        return self
+
+    def join_asof(self, collection: Iterable[Any],
+                  on: Union[int, str, Callable[[Any], Any]],
+                  by: Optional[Union[int, str, Callable[[Any], Hashable]]] = None,
+                  tolerance: Optional[Any] = None) -> 'Qjoin':
+        """
+        Performs an as-of join in a qjoin query with the base collection.
+
+        An element of the base collection is joined with the element of the collection that has the greatest ``on`` key
+        lower or equal to its own ``on`` key. When several elements share this key, the last one in the order of the collection
+        is used.
+
+        ``by`` restricts the match to the elements that share the same ``by`` key. ``tolerance`` is the maximum distance
+        between both ``on`` keys, beyond it there is no match.
+
+        >>> observations = [
+        >>>    {'spacecraft': 'Kepler', 'date': datetime.datetime(2012, 7, 16)},
+        >>>    {'spacecraft': 'lucy', 'date': datetime.datetime(2023, 11, 1)},
+        >>> ]
+        >>>
+        >>> orbital_parameters = [
+        >>>    {'spacecraft': 'Kepler', 'date': datetime.datetime(2012, 7, 1), 'period': 372.5},
+        >>>    {'spacecraft': 'lucy', 'date': datetime.datetime(2023, 10, 1), 'period': 365.3},
+        >>> ]
+        >>>
+        >>> latest_parameters = qjoin.on(observations) \
+        >>>     .join_asof(orbital_parameters, on='date', by='spacecraft', tolerance=datetime.timedelta(days=30))
+        >>> for observation, orbital_parameter in latest_parameters:
+        >>>     print(observation['date'], orbital_parameter['period'] if orbital_parameter else None)
+
+        The collection is sorted by ``by`` group once when the query is iterated, each element of the base collection is then
+        matched with a binary search.
+        """
+        join = QjoinAsofJoin(collection, on=on, by=by, tolerance=tolerance)
+        self.join_definitions.append(join)
+        return self
+
+    def join_lookup(self, fetch_many: Callable[[List[Hashable]], Any],
+                    left: Union[int, str, Callable[[Any], Hashable]],
+                    batch_size: int = 100,
+                    concurrency: int = 1,
+                    cache_size: int = 10000) -> 'Qjoin':
+        """
+        Performs a join in a qjoin query with elements fetched by key, from a service or a key-value store for example.
+
+        ``fetch_many`` takes a list of keys and returns either a dictionary from key to element, or a list of elements
+        in the order of the keys. ``left`` is the key of the base collection.
+
+        >>> def fetch_spacecraft_properties(names):
+        >>>     response = requests.get('https://api.example.com/spacecrafts', params={'name': names})
+        >>>     return {properties['name']: properties for properties in response.json()}
+        >>>
+        >>> global_spacecrafts = qjoin.on(spacecrafts).join_lookup(fetch_spacecraft_properties, left='name', batch_size=50, concurrency=4)
+
+        When the query is iterated, the keys of the base collection are collected and deduplicated, then fetched
+        by batches of ``batch_size`` keys, with up to ``concurrency`` batches fetched at the same time in threads.
+        A coroutine function is run with ``asyncio.run`` instead, the query then cannot be iterated while an event loop
+        is running. The last ``cache_size`` fetched elements are kept between the iterations of the query, they are not
+        fetched again. A key without element is joined with None.
+        """
+        if batch_size < 1 or concurrency < 1:
+            raise ValueError('batch_size and concurrency parameters of join_lookup must be greater than 0.')
+
+        if cache_size < 0:
+            raise ValueError('cache_size parameter of join_lookup must be greater or equal to 0.')
+
+        join = QjoinLookupJoin(fetch_many, left=left, batch_size=batch_size, concurrency=concurrency, cache_size=cache_size)
+        self.join_definitions.append(join)
+        return self
+
+    def exists(self, collection: Iterable[Any],
+               key: Optional[Union[int, str, Callable[[Any], Hashable]]] = None,
+               left: Optional[Union[int, str, Callable[[Any], Hashable]]] = None,
+               right: Optional[Union[int, str, Callable[[Any], Hashable]]] = None) -> 'Qjoin':
+        """
+        Keeps only the elements of the base collection that have a match in the collection (semi join).
+
+        The keys are declared as in ``join``. Only the set of keys of the collection is kept in memory and
+        no element is added to the tuples of the query.
+
+        >>> spacecrafts_with_properties = qjoin.on(spacecrafts).exists(spacecraft_properties, key='name').all()
+        >>> for spacecraft, in spacecrafts_with_properties:
+        >>>     print(spacecraft['name'])
+        """
+        _check_filter_keys('exists', key, left, right)
+
+        self.filter_definitions.append(QjoinFilter(collection, key=key, left=left, right=right))
+        return self
+
+    def not_exists(self, collection: Iterable[Any],
+                   key: Optional[Union[int, str, Callable[[Any], Hashable]]] = None,
+                   left: Optional[Union[int, str, Callable[[Any], Hashable]]] = None,
+                   right: Optional[Union[int, str, Callable[[Any], Hashable]]] = None) -> 'Qjoin':
+        """
+        Keeps only the elements of the base collection that have no match in the collection (anti join).
+
+        The keys are declared as in ``join``. Only the set of keys of the collection is kept in memory and
+        no element is added to the tuples of the query.
+
+        >>> spacecrafts_without_properties = qjoin.on(spacecrafts).not_exists(spacecraft_properties, key='name').all()
+        >>> for spacecraft, in spacecrafts_without_properties:
+        >>>     print(spacecraft['name'])
+        """
+        _check_filter_keys('not_exists', key, left, right)
+
+        self.filter_definitions.append(QjoinFilter(collection, key=key, left=left, right=right, negate=True))
+        return self
+
+    def distinct(self, key: Union[int, str, Callable[[Any], Hashable]],
+                 keep: str = 'first',
+                 false_positive_rate: Optional[float] = None,
+                 capacity: Optional[int] = None) -> 'Qjoin':
+        """
+        Removes the duplicates of the last collection declared in the qjoin query, the base collection when it is called
+        right after ``on``, otherwise the collection of the last join. Only one element is kept per key, the first one
+        or the last one depending on ``keep``.
+
+        >>> qjoin.on(spacecrafts) \
+        >>>     .distinct(key='name') \
+        >>>     .join(spacecraft_properties, key='name') \
+        >>>     .distinct(key='name', keep='last') \
+        >>>     .all()
+
+        The duplicates of the base collection are dropped before being joined. With ``keep='first'``, the keys already seen
+        are kept in a set while the collection is read. With ``keep='last'``, the collection is read a first time to find
+        the last element of each key.
+
+        For a very large number of keys, ``false_positive_rate`` and ``capacity``, the expected number of distinct keys,
+        keep the keys in a bloom filter of bounded size instead of a set. An element may then be dropped as a duplicate
+        with this probability. It requires ``keep='first'``.
+        """
+        if keep not in ('first', 'last'):
+            raise ValueError(f'keep parameter of distinct must be "first" or "last", not {keep!r}.')
+
+        if false_positive_rate is not None and (capacity is None or keep != 'first'):
+            raise ValueError('false_positive_rate parameter of distinct requires capacity parameter and keep="first".')
+
+        if capacity is not None and false_positive_rate is None:
+            raise ValueError('capacity parameter of distinct requires false_positive_rate parameter.')
+
+        if false_positive_rate is not None and not 0 < false_positive_rate < 1:
+            raise ValueError(f'false_positive_rate parameter of distinct must be between 0 and 1, not {false_positive_rate}.')
+
+        distinct = QjoinDistinct(key, keep=keep, false_positive_rate=false_positive_rate, capacity=capacity)
+        if not self.join_definitions:
+            self._base_distinct = distinct
+        elif isinstance(self.join_definitions[-1], QjoinLookupJoin):
+            raise ValueError('distinct cannot be applied on a lookup join in qjoin query.')
+        elif isinstance(self.join_definitions[-1].collection, (QjoinIndex, QjoinMappedIndex)):
+            raise ValueError('distinct cannot be applied on an index in qjoin query.')
+        else:
+            self.join_definitions[-1].distinct = distinct
+
+        return self
+
     def all(self) -> List[Tuple[Any, ...]]:
         """
         Return the result of qjoin query in a list of tuple where the first element of base collection
@@ -226,6 +523,415 @@ class Qjoin:
 
         return aggregates
 
+    def as_graph(self, klass: Type[T], parent: str, children: str,
+                 key: Optional[Union[int, str, Callable[[Any], Hashable]]] = None,
+                 parent_position: int = 1,
+                 child_position: int = 0) -> List[T]:
+        """
+        Creates a list of type T objects, one per distinct parent, each one holding the list of its children.
+
+        The parent is the element at ``parent_position`` in the tuples of the query, by default the element of the first join,
+        and is written to the ``parent`` attribute. The children are the elements at ``child_position``, by default the element
+        of the base collection, and are appended to the ``children`` attribute in the order of the query. The rows without
+        parent are ignored.
+
+        >>> @dataclasses.dataclass
+        >>> class SpacecraftAggregate:
+        >>>   spacecraft: dict = dataclasses.field(init=False)
+        >>>   missions: list = dataclasses.field(init=False)
+
+        >>> missions = [
+        >>>   {'mission': 'Kepler primary mission', 'spacecraft': 'Kepler'},
+        >>>   {'mission': 'K2', 'spacecraft': 'Kepler'},
+        >>>   {'mission': 'Lucy', 'spacecraft': 'lucy'},
+        >>> ]
+        >>>
+        >>> for spacecraft in qjoin.on(missions) \
+        >>>                        .join(spacecrafts, left='spacecraft', right='name') \
+        >>>                        .as_graph(SpacecraftAggregate, parent='spacecraft', children='missions'):
+        >>>     print(spacecraft.spacecraft['name'], len(spacecraft.missions))
+
+        A single object is created per parent thanks to an identity map. By default a parent is identified by the key
+        of its join collection, ``right`` or ``key`` of the join, so that equal parents that are distinct objects, for example
+        with ``qjoin.columns`` or ``qjoin.load_index`` collections, share an object. Other parents are identified by the element
+        itself. ``key`` identifies them by a field or a function instead.
+
+        The ``__post_qjoin__`` method is called once per object, when all its children have been attached.
+        """
+        get_key = _parent_key_getter(self.join_definitions, parent_position)
+        if key is not None:
+            get_key = _element_key_getter(key)
+
+        aggregates: Dict[Hashable, T] = {}
+        for elt in self:
+            parent_element = elt[parent_position]
+            if parent_element is None:
+                continue
+
+            parent_key = get_key(parent_element)
+            _instance = aggregates.get(parent_key)
+            if _instance is None:
+                _instance = klass()
+                for attr in (parent, children):
+                    if not hasattr(_instance, attr):
+                        logger.warning(f'Attribute {attr} is not defined in {klass.__name__} class.')
+
+                setattr(_instance, parent, parent_element)
+                setattr(_instance, children, [])
+                aggregates[parent_key] = _instance
+
+            getattr(_instance, children).append(elt[child_position])
+
+        for _instance in aggregates.values():
+            if hasattr(_instance, '__post_qjoin__'):
+                _instance.__post_qjoin__()
+
+        return list(aggregates.values())
+
+    def materialize(self) -> 'QjoinView':
+        """
+        Computes the result of the qjoin query once and returns a live view on it.
+
+        The view keeps an index on the keys of each join. Elements can then be inserted in or deleted from the base
+        collection and the join collections without recomputing the whole result, only the affected rows are updated.
+        The collections given to the query are not modified.
+
+        >>> view = qjoin.on(spacecrafts).join(spacecraft_properties, key='name').materialize()
+        >>> view.on_change(lambda event, old_row, new_row: print(event, old_row, new_row))
+        >>> view.insert({'name': 'Psyche', 'cospar_id': '2023-157A', 'satcat': 58128})
+        >>> view.insert_join(0, {'name': 'Psyche', 'power': 4500, 'launch_mass': 2608})
+        >>> for spacecraft, spacecraft_properties in view:
+        >>>     print(spacecraft['name'])
+
+        Only the joins declared with ``join`` can be materialized.
+        """
+        if self.filter_definitions:
+            raise ValueError('exists and not_exists filters cannot be materialized in a qjoin query.')
+
+        if self._base_distinct is not None or any(join_definition.distinct is not None for join_definition in self.join_definitions):
+            raise ValueError('distinct cannot be materialized in a qjoin query.')
+
+        join_definitions: List[QjoinJoin] = []
+        for join_definition in self.join_definitions:
+            if not isinstance(join_definition, QjoinJoin):
+                raise ValueError(f'{type(join_definition).__name__} cannot be materialized in a qjoin query, only joins declared with join can.')
+
+            if isinstance(join_definition.collection, (QjoinIndex, QjoinMappedIndex)):
+                raise ValueError('a join on an index cannot be materialized in a qjoin query.')
+
+            join_definitions.append(join_definition)
+
+        return QjoinView(self._base_collection, join_definitions)
+
+    def stream(self, window: Optional[int] = None,
+               window_time: Optional[float] = None,
+               timestamp: Optional[Union[int, str, Callable[[Any], float]]] = None) -> Iterator[Tuple[Any, Any]]:
+        """
+        Joins the base collection with the join collection as unbounded streams.
+
+        Both collections are consumed at the same time, each one in its own thread, and a couple is emitted as soon as
+        an element and its match have both arrived. Only the elements that have a match are emitted. The query must declare
+        exactly one join with ``join``.
+
+        >>> orders = iter(orders_queue.get, None)
+        >>> payments = iter(payments_queue.get, None)
+        >>>
+        >>> for order, payment in qjoin.on(orders).join(payments, key='order_id').stream(window_time=3600, timestamp='created_at'):
+        >>>     print(order['order_id'], payment['amount'])
+
+        To keep the memory bounded, the elements waiting for a match are evicted in arrival order:
+
+        * ``window`` keeps at most this number of elements of each collection
+        * ``window_time`` keeps the elements whose timestamp is within this duration of the latest timestamp. The timestamp
+          is read with ``timestamp`` on the elements, by default it is the arrival time in seconds. An element that arrives
+          older than the window is dropped.
+
+        ``distinct`` is supported with ``keep="first"`` and ``false_positive_rate``, the keys already seen are kept in
+        a bloom filter of bounded size.
+
+        Each collection is read at most one element ahead of the consumer. When the stream is closed before its end,
+        the elements already read ahead are lost, and a thread blocked in ``next`` on a collection, like
+        ``iter(queue.get, None)``, keeps running until the collection returns an element.
+        """
+        if self.filter_definitions or len(self.join_definitions) != 1 or not isinstance(self.join_definitions[0], QjoinJoin):
+            raise ValueError('stream requires exactly one join declared with join and no exists or not_exists filter in qjoin query.')
+
+        if any(distinct is not None and (distinct.keep != 'first' or distinct.false_positive_rate is None) for distinct in (self._base_distinct, self.join_definitions[0].distinct)):
+            raise ValueError('stream only supports distinct with keep="first" and false_positive_rate in qjoin query, to keep the memory bounded.')
+
+        if timestamp is not None and window_time is None:
+            raise ValueError('timestamp parameter of stream requires window_time parameter.')
+
+        return _symmetric_hash_join(self._base_collection, self.join_definitions[0], window, window_time, timestamp, self._base_distinct)
+
+
+class QjoinView:
+    """
+    Live result of a qjoin query, see ``Qjoin.materialize``.
+
+    The view keeps for each join the elements of the join collection by key and the rows of the result by key of the base
+    element, so that an insertion or a deletion only updates the affected rows.
+    """
+
+    def __init__(self, base_collection: Iterable[Any], join_definitions: List['QjoinJoin']):
+        self._left_getters: List[Callable[[Any], Hashable]] = []
+        self._right_getters: List[Callable[[Any], Hashable]] = []
+        self._join_indexes: List[Dict[Hashable, List[Any]]] = []
+        self._row_indexes: List[Dict[Hashable, List[int]]] = []
+        self._rows: Dict[int, List[Any]] = {}
+        self._next_row_id = 0
+        self._callbacks: List[Callable[[str, Optional[Tuple[Any, ...]], Optional[Tuple[Any, ...]]], None]] = []
+
+        for join_definition in join_definitions:
+            get_left, get_right = _element_join_key_getters(join_definition)
+            self._left_getters.append(get_left)
+            self._right_getters.append(get_right)
+            self._row_indexes.append({})
+            join_index: Dict[Hashable, List[Any]] = {}
+            for element in join_definition.collection:
+                join_index.setdefault(self._right_getters[-1](element), []).append(element)
+            self._join_indexes.append(join_index)
+
+        for element in base_collection:
+            self.insert(element)
+
+    def __iter__(self):
+        for row in self._rows.values():
+            yield tuple(row)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def all(self) -> List[Tuple[Any, ...]]:
+        """
+        Returns the current result of the view in a list of tuple, as ``Qjoin.all`` does.
+        """
+        return list(self)
+
+    def on_change(self, callback: Callable[[str, Optional[Tuple[Any, ...]], Optional[Tuple[Any, ...]]], None]) -> None:
+        """
+        Registers a function called on every change of a row of the view.
+
+        The function receives the event, ``insert``, ``update`` or ``delete``, the row before the change and the row after
+        the change. The row before an insertion and the row after a deletion are None.
+
+        >>> view.on_change(lambda event, old_row, new_row: cache.invalidate(old_row))
+        """
+        self._callbacks.append(callback)
+
+    def insert(self, element: Any) -> None:
+        """
+        Inserts an element in the base collection of the view and adds its row to the result.
+        """
+        row_id = self._next_row_id
+        self._next_row_id += 1
+
+        row = [element]
+        for join_position, join_index in enumerate(self._join_indexes):
+            key = self._left_getters[join_position](element)
+            elements_to_join = join_index.get(key)
+            row.append(elements_to_join[0] if elements_to_join else None)
+            self._row_indexes[join_position].setdefault(key, []).append(row_id)
+
+        self._rows[row_id] = row
+        self._notify('insert', None, tuple(row))
+
+    def delete(self, element: Any) -> None:
+        """
+        Deletes the first element of the base collection of the view equal to element and removes its row from the result.
+
+        Raises ValueError if the element is not in the view.
+        """
+        if self._row_indexes:
+            candidates = self._row_indexes[0].get(self._left_getters[0](element), [])
+        else:
+            candidates = list(self._rows)
+
+        row_id = next((candidate for candidate in candidates if self._rows[candidate][0] == element), None)
+        if row_id is None:
+            raise ValueError('element is not in the base collection of the qjoin view.')
+
+        row = self._rows.pop(row_id)
+        for join_position, row_index in enumerate(self._row_indexes):
+            key = self._left_getters[join_position](element)
+            row_index[key].remove(row_id)
+            if not row_index[key]:
+                del row_index[key]
+
+        self._notify('delete', tuple(row), None)
+
+    def insert_join(self, join_position: int, element: Any) -> None:
+        """
+        Inserts an element in the collection of the join at ``join_position``, 0 for the first join of the query.
+
+        The rows that had no match for this join and share the key of the element are updated.
+        """
+        key = self._right_getters[join_position](element)
+        elements_to_join = self._join_indexes[join_position].setdefault(key, [])
+        elements_to_join.append(element)
+        if len(elements_to_join) == 1:
+            self._update_rows(join_position, key, element)
+
+    def delete_join(self, join_position: int, element: Any) -> None:
+        """
+        Deletes the first element equal to element from the collection of the join at ``join_position``,
+        0 for the first join of the query.
+
+        The rows that were joined with this element are joined with the next element that shares its key, or None.
+        Raises ValueError if the element is not in the join collection.
+        """
+        key = self._right_getters[join_position](element)
+        join_index = self._join_indexes[join_position]
+        elements_to_join = join_index.get(key, [])
+        position = next((position for position, element_to_join in enumerate(elements_to_join) if element_to_join == element), None)
+        if position is None:
+            raise ValueError(f'element is not in the collection of the join {join_position} of the qjoin view.')
+
+        del elements_to_join[position]
+        if not elements_to_join:
+            del join_index[key]
+
+        if position == 0:
+            self._update_rows(join_position, key, elements_to_join[0] if elements_to_join else None)
+
+    def _update_rows(self, join_position: int, key: Hashable, element_to_join: Any) -> None:
+        for row_id in self._row_indexes[join_position].get(key, []):
+            row = self._rows[row_id]
+            old_row = tuple(row)
+            row[join_position + 1] = element_to_join
+            self._notify('update', old_row, tuple(row))
+
+    def _notify(self, event: str, old_row: Optional[Tuple[Any, ...]], new_row: Optional[Tuple[Any, ...]]) -> None:
+        for callback in self._callbacks:
+            callback(event, old_row, new_row)
+
+
+def _symmetric_hash_join(base_collection: Iterable[Any], join_definition: QjoinJoin,
+                         window: Optional[int], window_time: Optional[float],
+                         timestamp: Optional[Union[int, str, Callable[[Any], float]]],
+                         base_distinct: Optional['QjoinDistinct']) -> Iterator[Tuple[Any, Any]]:
+    """
+    Consumes the base collection and the join collection at the same time and yields every couple that matches
+    with the elements still in the windows of the other side.
+    """
+    get_keys = _element_join_key_getters(join_definition)
+    get_timestamp: Callable[[Any], float] = lambda elt: time.monotonic()
+    if timestamp is not None:
+        get_timestamp = cast(Callable[[Any], float], _element_key_getter(timestamp))
+
+    windows = (_StreamWindow(window), _StreamWindow(window))
+    keep_distinct = tuple(
+        _distinct_keep(None, distinct, _element_key_getter(distinct.key)) if distinct is not None else None
+        for distinct in (base_distinct, join_definition.distinct)
+    )
+
+    latest_timestamp: Optional[float] = None
+    for side, element in _interleave(base_collection, join_definition.collection):
+        keep = keep_distinct[side]
+        if keep is not None and not keep(None, element):
+            continue
+
+        key = get_keys[side](element)
+        element_timestamp: Optional[float] = None
+        if window_time is not None:
+            element_timestamp = get_timestamp(element)
+            latest_timestamp = element_timestamp if latest_timestamp is None else max(latest_timestamp, element_timestamp)
+            oldest_timestamp = latest_timestamp - window_time
+            windows[0].evict_before(oldest_timestamp)
+            windows[1].evict_before(oldest_timestamp)
+            if element_timestamp < oldest_timestamp:
+                continue
+
+        for element_to_join in windows[1 - side].get(key):
+            yield (element, element_to_join) if side == 0 else (element_to_join, element)
+
+        windows[side].add(key, element, element_timestamp)
+
+
+class _StreamWindow:
+    """
+    Elements of one side of a stream join waiting for a match, indexed by key and evicted in arrival order.
+    """
+
+    def __init__(self, size: Optional[int]):
+        self.size = size
+        self.entries: Deque[Tuple[Hashable, Optional[float]]] = collections.deque()
+        self.elements: Dict[Hashable, Deque[Any]] = {}
+
+    def add(self, key: Hashable, element: Any, timestamp: Optional[float]) -> None:
+        self.entries.append((key, timestamp))
+        self.elements.setdefault(key, collections.deque()).append(element)
+        if self.size is not None and len(self.entries) > self.size:
+            self._evict_oldest()
+
+    def evict_before(self, timestamp: float) -> None:
+        while self.entries:
+            entry_timestamp = self.entries[0][1]
+            if entry_timestamp is None or entry_timestamp >= timestamp:
+                break
+
+            self._evict_oldest()
+
+    def get(self, key: Hashable) -> List[Any]:
+        return list(self.elements.get(key, ()))
+
+    def _evict_oldest(self) -> None:
+        key, _ = self.entries.popleft()
+        elements = self.elements[key]
+        elements.popleft()
+        if not elements:
+            del self.elements[key]
+
+
+def _interleave(*iterables: Iterable[Any]) -> Iterator[Tuple[int, Any]]:
+    """
+    Consumes each iterable in its own thread and yields ``(position of the iterable, element)`` in arrival order.
+    An exception raised by an iterable is raised again in the consumer.
+
+    A thread reads the next element of its iterable only once the previous one has been taken by the consumer, at most
+    one element per iterable is read ahead. When the consumer stops, the elements read ahead are lost and a thread blocked
+    in ``next`` on its iterable keeps running until the iterable returns.
+    """
+    events: 'queue.Queue[Tuple[int, Any, Optional[Exception]]]' = queue.Queue()
+    slots = [threading.Semaphore(1) for _ in iterables]
+    stop = threading.Event()
+
+    def acquire(side: int) -> bool:
+        while not stop.is_set():
+            if slots[side].acquire(timeout=0.1):
+                return True
+
+        return False
+
+    def pump(side: int, iterable: Iterable[Any]) -> None:
+        try:
+            iterator = iter(iterable)
+            while acquire(side):
+                element = next(iterator, _END_OF_STREAM)
+                events.put((side, element, None))
+                if element is _END_OF_STREAM:
+                    return
+        except Exception as exception:
+            events.put((side, _END_OF_STREAM, exception))
+
+    for side, iterable in enumerate(iterables):
+        threading.Thread(target=pump, args=(side, iterable), daemon=True).start()
+
+    try:
+        running = len(iterables)
+        while running:
+            side, element, exception = events.get()
+            if exception is not None:
+                raise exception
+
+            if element is _END_OF_STREAM:
+                running -= 1
+            else:
+                slots[side].release()
+                yield side, element
+    finally:
+        stop.set()
+
 
 def on(collection: Iterable[Any]) -> 'Qjoin':
     """
@@ -245,6 +951,28 @@ def on(collection: Iterable[Any]) -> 'Qjoin':
     return Qjoin(collection)
 
 
+def index(collection: Iterable[Any], key: Union[int, str, Callable[[Any], Hashable]], spec: Optional[str] = None) -> QjoinIndex:
+    """
+    Builds the index of a join collection on a key. The index can be used as a join collection in several queries
+    and saved to a file to be reopened with ``qjoin.load_index``.
+
+    >>> spacecraft_properties_index = qjoin.index(spacecraft_properties, key='name')
+    >>> spacecraft_properties_index.save('spacecraft_properties.idx', fingerprint='v42')
+    >>>
+    >>> qjoin.on(spacecrafts).join(spacecraft_properties_index, key='name').all()
+
+    The key is recorded in the file to detect a stale index. Only a module level function can be identified by name,
+    ``spec`` describes other key functions and is checked by ``qjoin.load_index(path, spec=...)``.
+
+    >>> qjoin.index(spacecraft_properties, key=lambda s: s['name'].lower(), spec='lower_name').save('spacecraft_properties.idx')
+    """
+    join_index = _build_index(collection, key)
+    if spec is not None:
+        join_index.key_spec = spec
+
+    return join_index
+
+
 def _is_collection_subscriptable(collection: Iterable[Any]) -> bool:
     """
     Identifie si les éléments d'une collection sont adressés par index, comme par exemple pour une liste, un tuple ou un dictionnaire
@@ -254,6 +982,17 @@ def _is_collection_subscriptable(collection: Iterable[Any]) -> bool:
     return hasattr(first, '__getitem__')
 
 
+def _materialize(collection: Iterable[Any]) -> Iterable[Any]:
+    """
+    Reads a one-shot iterator, like a generator, in a list. The keys of a collection are looked up on its first
+    element before the collection is iterated, which would lose this element.
+    """
+    if isinstance(collection, collections.abc.Iterator):
+        return list(collection)
+
+    return collection
+
+
 def _is_collection_empty(collection: Iterable[Any]) -> bool:
     try:
         first = next(collection.__iter__())
@@ -262,5 +1001,535 @@ def _is_collection_empty(collection: Iterable[Any]) -> bool:
         return True
 
 
+def _check_join_keys(operation: str, key: Any, left: Any, right: Any) -> None:
+    if key is None and left is None and right is None:
+        raise ValueError(f'A key has to be specified when using {operation} in qjoin query. qjoin.{operation}(key="mykey") or qjoin.{operation}(key=lambda x: x.mykey)')
+
+    if key is not None and (left is not None or right is not None):
+        raise ValueError('key parameter should be used alone, it must not be used with left or right parameters.')
+
+    if left is not None and right is None:
+        raise ValueError(f'A right key parameter has to be specified when using {operation} in qjoin query and left. qjoin.{operation}(left="any", right="mykey") or qjoin.{operation}(left=lambda x: x.mykey, right=lambda x: x.mykey2)')
+
+
+def _check_filter_keys(operation: str, key: Any, left: Any, right: Any) -> None:
+    _check_join_keys(operation, key, left, right)
+    if key is None and left is None:
+        raise ValueError(f'A left key parameter has to be specified when using {operation} in qjoin query and right. qjoin.{operation}(left="any", right="mykey") or qjoin.{operation}(left=lambda x: x.mykey, right=lambda x: x.mykey2)')
+
+
+def _join_keys(join_definition: Union[QjoinJoin, QjoinFilter]) -> Tuple[Any, Any]:
+    """
+    Returns the key to read on the base collection and the key to read on the join collection.
+    """
+    if join_definition.key is not None:
+        return join_definition.key, join_definition.key
+
+    return join_definition.left, join_definition.right
+
+
+def _join_batch_keys(join_definition: Union[QjoinJoin, QjoinRangeJoin, QjoinAsofJoin]) -> Tuple[Any, Any]:
+    """
+    Returns the batch key function of the base collection and the one of the join collection, if the join uses them.
+    """
+    if not isinstance(join_definition, QjoinJoin):
+        return None, None
+
+    if join_definition.key_batch is not None:
+        return join_definition.key_batch, join_definition.key_batch
+
+    return join_definition.left_batch, join_definition.right_batch
+
+
+def _parent_key_getter(join_definitions: List[Union[QjoinJoin, QjoinRangeJoin, QjoinAsofJoin, 'QjoinLookupJoin']], parent_position: int) -> Callable[[Any], Hashable]:
+    """
+    Returns the function that identifies a parent of ``Qjoin.as_graph``: the key of its join collection when the parent
+    comes from a join declared with ``join``, otherwise the element itself.
+    """
+    if parent_position < 1 or parent_position > len(join_definitions):
+        return id
+
+    join_definition = join_definitions[parent_position - 1]
+    if not isinstance(join_definition, QjoinJoin):
+        return id
+
+    if _join_keys(join_definition)[1] is None and _join_batch_keys(join_definition)[1] is None:
+        return id
+
+    return _element_join_key_getters(join_definition)[1]
+
+
+def _element_join_key_getters(join_definition: QjoinJoin) -> Tuple[Callable[[Any], Hashable], Callable[[Any], Hashable]]:
+    """
+    Returns the functions that read the key of a single element of the base collection and of the join collection.
+    A batch key function is called with a list of one element.
+    """
+    getters: List[Callable[[Any], Hashable]] = []
+    for key, key_batch in zip(_join_keys(join_definition), _join_batch_keys(join_definition)):
+        if key_batch is not None:
+            getters.append(_element_batch_key_getter(key_batch))
+        elif key is not None:
+            getters.append(_element_key_getter(key))
+        else:
+            getters.append(lambda elt: cast(Hashable, _NO_MATCH))
+
+    return getters[0], getters[1]
+
+
+def _element_batch_key_getter(key_batch: Callable[[List[Any]], List[Hashable]]) -> Callable[[Any], Hashable]:
+    return lambda elt: key_batch([elt])[0]
+
+
+def _element_key_getter(key: Union[int, str, Callable[[Any], Hashable]]) -> Callable[[Any], Hashable]:
+    """
+    Returns the function that reads the key of an element, by subscription or by attribute depending on the element itself.
+    It is used when the collection is not known in advance, for example when elements are inserted one by one.
+    """
+    if callable(key):
+        return key
+
+    if isinstance(key, int):
+        return lambda elt: elt[key]
+
+    return lambda elt: elt[key] if hasattr(elt, '__getitem__') else getattr(elt, key)
+
+
+def _check_index_keys(join_index: Union[QjoinIndex, QjoinMappedIndex], key: Any, left: Any, right: Any) -> None:
+    if key is None and left is None:
+        raise ValueError('A key has to be specified when using join on an index in qjoin query. qjoin.join(index, left="mykey") or qjoin.join(index, left=lambda x: x.mykey)')
+
+    if key is not None and (left is not None or right is not None):
+        raise ValueError('key parameter should be used alone, it must not be used with left or right parameters.')
+
+    index_key = key if key is not None else right
+    if index_key is not None and key_spec(index_key) is None:
+        raise ValueError('the key of an index can only be checked against a name or a module level function, use left parameter alone: qjoin.join(index, left=lambda x: x.mykey)')
+
+    if index_key is not None and key_spec(index_key) != join_index.key_spec:
+        raise ValueError(f'the index is built on key {join_index.key_spec}, it cannot be joined on {key_spec(index_key)}.')
+
+
+def _first_defined(*values: Any) -> Any:
+    return next((value for value in values if value is not None), None)
+
+
+def _key_access(collection: Iterable[Any], key: Union[int, str, Callable[[Any], Hashable]]) -> str:
+    """
+    Tells how the key of an element of the collection is read: ``call`` the key function, ``item`` by subscription,
+    ``attr`` by attribute depending on the elements of the collection, or ``none`` if the collection is empty.
+    """
+    if callable(key):
+        return 'call'
+
+    if _is_collection_empty(collection):
+        return 'none'
+
+    if _is_collection_subscriptable(collection):
+        return 'item'
+
+    return 'attr'
+
+
+def _key_getter(collection: Iterable[Any], key: Union[int, str, Callable[[Any], Hashable]]) -> Callable[[Any], Hashable]:
+    """
+    Returns the function that reads the key of an element of the collection, either by calling the key function,
+    by subscription or by attribute depending on the elements of the collection.
+    """
+    access = _key_access(collection, key)
+    if access == 'call':
+        return cast(Callable[[Any], Hashable], key)
+
+    if access == 'none':
+        return lambda elt: None
+
+    if access == 'item':
+        return operator.itemgetter(key)
+
+    attribute = cast(str, key)
+    return lambda elt: getattr(elt, attribute)
+
+
+def _filter_predicate(base_collection: Iterable[Any], filter_definition: QjoinFilter) -> Callable[[Any], bool]:
+    """
+    Builds the set of keys of the filter collection and returns the predicate that tells if an element
+    of the base collection has to be kept.
+    """
+    left, right = _join_keys(filter_definition)
+    get_right = _key_getter(filter_definition.collection, right)
+    keys = {get_right(element) for element in filter_definition.collection}
+    get_left = _key_getter(base_collection, left)
+    if filter_definition.negate:
+        return lambda elt: get_left(elt) not in keys
+
+    return lambda elt: get_left(elt) in keys
+
+
+def _distinct_keep(collection: Optional[Iterable[Any]], distinct: QjoinDistinct, get_key: Callable[[Any], Hashable]) -> Callable[[Optional[int], Any], bool]:
+    """
+    Returns the function that tells if an element of a collection, at a given position, is kept by the deduplication.
+    With ``keep='first'`` the function has to be called on the elements in the order of the collection and the position
+    is not used.
+    """
+    if distinct.keep == 'last':
+        assert collection is not None, 'keep="last" is refused by stream, the only caller without a collection'
+        last_positions = {get_key(element): position for position, element in enumerate(collection)}
+        return lambda position, elt: last_positions[get_key(elt)] == position
+
+    seen_keys: Union[Set[Hashable], _BloomFilter] = set()
+    if distinct.false_positive_rate is not None:
+        assert distinct.capacity is not None, 'Qjoin.distinct requires capacity with false_positive_rate'
+        seen_keys = _BloomFilter(distinct.capacity, distinct.false_positive_rate)
+
+    def keep(position: Optional[int], element: Any) -> bool:
+        key = get_key(element)
+        if key in seen_keys:
+            return False
+
+        seen_keys.add(key)
+        return True
+
+    return keep
+
+
+def _distinct_collection(collection: Iterable[Any], distinct: QjoinDistinct) -> List[Any]:
+    keep = _distinct_keep(collection, distinct, _key_getter(collection, distinct.key))
+    return [element for position, element in enumerate(collection) if keep(position, element)]
+
+
+class _BloomFilter:
+    """
+    Set of keys of bounded size that may answer that a key is present when it is not, with the given probability
+    for the given number of keys.
+    """
+
+    def __init__(self, capacity: int, false_positive_rate: float):
+        self.size = max(8, math.ceil(-max(capacity, 1) * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / max(capacity, 1) * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return all(self.bits[bit // 8] & (1 << (bit % 8)) for bit in self._bits(key))
+
+    def add(self, key: Hashable) -> None:
+        for bit in self._bits(key):
+            self.bits[bit // 8] |= 1 << (bit % 8)
+
+    def _bits(self, key: Hashable) -> Iterator[int]:
+        first_hash = hash(key)
+        second_hash = hash((key, self.size)) | 1
+        for position in range(self.hash_count):
+            yield (first_hash + position * second_hash) % self.size
+
+
+class _Probe(NamedTuple):
+    """
+    How a join finds the element to join with an element of the base collection. ``kind`` tells how ``extract``
+    reads the key of the element before it is given to ``lookup``:
+
+    * ``item``: ``lookup(element[extract])``
+    * ``attr``: ``lookup(getattr(element, extract))``
+    * ``call``: ``lookup(extract(element))``
+    * ``position``: ``lookup(extract[position])``, the keys have been computed in advance
+    * ``probe``: ``lookup(position, element)``, ``extract`` is not used
+    """
+    kind: str
+    lookup: Callable[..., Any]
+    extract: Any = None
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_iterator(has_distinct: bool, filter_count: int, probe_kinds: Tuple[str, ...]) -> Callable[..., Iterator[Tuple[Any, ...]]]:
+    """
+    Generates the loop of a qjoin query for its shape: deduplication of the base collection, number of filters and kind
+    of each join. The filters and the joins are unrolled and the tuple is built directly, as
+    ``collections.namedtuple`` generates its class. The function is compiled once per shape.
+
+    >>> _compile_iterator(False, 1, ('item',))
+
+    generates
+
+    >>> def qjoin_iterator(base_collection, keep_0, lookup_0, extract_0):
+    >>>     for element in base_collection:
+    >>>         if not keep_0(element):
+    >>>             continue
+    >>>         yield (element, lookup_0(element[extract_0]),)
+    """
+    expressions = {
+        'item': 'lookup_{0}(element[extract_{0}])',
+        'attr': 'lookup_{0}(getattr(element, extract_{0}))',
+        'call': 'lookup_{0}(extract_{0}(element))',
+        'position': 'lookup_{0}(extract_{0}[position])',
+        'probe': 'lookup_{0}(position, element)',
+    }
+
+    parameters = ['base_collection']
+    body = []
+    if has_distinct:
+        parameters.append('keep_distinct')
+        body += ['if not keep_distinct(position, element):', '    continue']
+
+    for filter_position in range(filter_count):
+        parameters.append(f'keep_{filter_position}')
+        body += [f'if not keep_{filter_position}(element):', '    continue']
+
+    slots = ['element']
+    for probe_position, probe_kind in enumerate(probe_kinds):
+        parameters += [f'lookup_{probe_position}', f'extract_{probe_position}']
+        slots.append(expressions[probe_kind].format(probe_position))
+
+    body.append(f'yield ({", ".join(slots)},)')
+
+    uses_position = has_distinct or any(probe_kind in ('position', 'probe') for probe_kind in probe_kinds)
+    loop = 'for position, element in enumerate(base_collection):' if uses_position else 'for element in base_collection:'
+    source = f'def qjoin_iterator({", ".join(parameters)}):\n    {loop}\n' + ''.join(f'        {line}\n' for line in body)
+
+    namespace: Dict[str, Any] = {}
+    exec(compile(source, f'<qjoin iterator {has_distinct}, {filter_count}, {probe_kinds}>', 'exec'), namespace)
+    return namespace['qjoin_iterator']
+
+
+def _hash_probe(base_collection: Iterable[Any], join_definition: QjoinJoin) -> _Probe:
+    """
+    Returns how to find the first element of the join collection that has the key of an element of the
+    base collection, using the index of the join collection.
+
+    With batch key functions, the keys of the base collection are all computed before the first lookup and are
+    read by position. A column of a ``QjoinColumns`` collection is read directly as well.
+    """
+    left, right = _join_keys(join_definition)
+    left_batch, right_batch = _join_batch_keys(join_definition)
+    if left is None and left_batch is None:
+        return _Probe('probe', lambda position, elt: None)
+
+    join_index: Union[QjoinIndex, QjoinMappedIndex, _ColumnIndex]
+    if isinstance(join_definition.collection, (QjoinIndex, QjoinMappedIndex)):
+        join_index = join_definition.collection
+    elif right_batch is not None:
+        join_index = _build_batch_index(join_definition.collection, right_batch)
+    elif isinstance(join_definition.collection, QjoinColumns) and isinstance(right, str):
+        join_index = join_definition.collection.index(right)
+    else:
+        join_index = _build_index(join_definition.collection, right)
+
+    if left_batch is not None:
+        # the base collection has been read in a list by ``Qjoin.__iter__`` when a join uses a batch key function
+        return _Probe('position', join_index.get, _batch_keys(cast(List[Any], base_collection), left_batch))
+
+    if isinstance(base_collection, QjoinColumns) and isinstance(left, str):
+        return _Probe('position', join_index.get, base_collection.column(left))
+
+    return _Probe(_key_access(base_collection, left), join_index.get, left)
+
+
+def _build_index(collection: Iterable[Any], key: Union[int, str, Callable[[Any], Hashable]]) -> QjoinIndex:
+    get_key = _key_getter(collection, key)
+    elements: Dict[Hashable, Any] = {}
+    for element in collection:
+        elements.setdefault(get_key(element), element)
+
+    return QjoinIndex(key_spec(key), elements)
+
+
+def _build_batch_index(collection: Iterable[Any], key_batch: Callable[[List[Any]], List[Hashable]]) -> QjoinIndex:
+    collection = list(collection)
+    elements: Dict[Hashable, Any] = {}
+    for key, element in zip(_batch_keys(collection, key_batch), collection):
+        elements.setdefault(key, element)
+
+    return QjoinIndex(key_spec(key_batch), elements)
+
+
+def _batch_keys(collection: List[Any], key_batch: Callable[[List[Any]], List[Hashable]]) -> List[Hashable]:
+    if not collection:
+        return []
+
+    keys = list(key_batch(collection))
+    if len(keys) != len(collection):
+        raise ValueError(f'{getattr(key_batch, "__name__", repr(key_batch))} returned {len(keys)} keys for {len(collection)} elements, a batch key function must return one key per element.')
+
+    return keys
+
+
+def _range_probe(base_collection: Iterable[Any], join_definition: QjoinRangeJoin) -> _Probe:
+    """
+    Returns how to find the first element of the collection whose interval contains the value
+    of an element of the base collection.
+    """
+    get_value = _key_getter(base_collection, join_definition.value)
+    index = _RangeIndex(join_definition.collection,
+                        _key_getter(join_definition.collection, join_definition.start),
+                        _key_getter(join_definition.collection, join_definition.end))
+    return _Probe('call', index.get, get_value)
+
+
+def _lookup_probe(base_collection: List[Any], join_definition: QjoinLookupJoin) -> _Probe:
+    """
+    Fetches the elements of all the keys of the base collection and returns how to find them by position.
+    """
+    get_left = _key_getter(base_collection, join_definition.left)
+    keys = [get_left(element) for element in base_collection]
+    elements = _fetch_lookup(join_definition, [key for key in dict.fromkeys(keys) if key is not None])
+    return _Probe('position', elements.get, keys)
+
+
+def _fetch_lookup(join_definition: QjoinLookupJoin, keys: List[Hashable]) -> Dict[Hashable, Any]:
+    """
+    Returns the elements of the keys, from the cache of the join or fetched by batches, and updates the cache.
+    """
+    cache = join_definition.cache
+    elements: Dict[Hashable, Any] = {}
+    missing_keys = []
+    for key in keys:
+        if key in cache:
+            cache.move_to_end(key)
+            elements[key] = cache[key]
+        else:
+            missing_keys.append(key)
+
+    batches = [missing_keys[start:start + join_definition.batch_size] for start in range(0, len(missing_keys), join_definition.batch_size)]
+    fetch_many_name = getattr(join_definition.fetch_many, '__name__', repr(join_definition.fetch_many))
+    if inspect.iscoroutinefunction(join_definition.fetch_many):
+        if _has_running_loop():
+            raise ValueError(f'the coroutine function {fetch_many_name} of join_lookup cannot be run while an event loop is running, iterate the query in a thread, for example with asyncio.to_thread(query.all).')
+
+        results = asyncio.run(_fetch_lookup_async(join_definition.fetch_many, batches, join_definition.concurrency))
+    elif join_definition.concurrency > 1 and len(batches) > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=join_definition.concurrency) as executor:
+            results = list(executor.map(join_definition.fetch_many, batches))
+    else:
+        results = [join_definition.fetch_many(batch) for batch in batches]
+
+    for batch, result in zip(batches, results):
+        if isinstance(result, Mapping):
+            fetched_elements = {key: result.get(key) for key in batch}
+        else:
+            result = list(result)
+            if len(result) != len(batch):
+                raise ValueError(f'{fetch_many_name} returned {len(result)} elements for {len(batch)} keys, it must return a dictionary or one element per key.')
+
+            fetched_elements = dict(zip(batch, result))
+
+        elements.update(fetched_elements)
+        cache.update(fetched_elements)
+
+    while len(cache) > join_definition.cache_size:
+        cache.popitem(last=False)
+
+    return elements
+
+
+def _has_running_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+async def _fetch_lookup_async(fetch_many: Callable[[List[Hashable]], Any], batches: List[List[Hashable]], concurrency: int) -> List[Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(batch: List[Hashable]) -> Any:
+        async with semaphore:
+            return await fetch_many(batch)
+
+    return list(await asyncio.gather(*(fetch(batch) for batch in batches)))
+
+
+class _RangeIndex:
+    """
+    Sorted index of the intervals [start, end) of a collection.
+
+    The bounds of the intervals cut the line in elementary segments. For each segment, the index stores the first element
+    of the collection, in the order of the collection, whose interval covers the segment. A lookup is then a binary search
+    on the bounds.
+    """
+
+    def __init__(self, collection: Iterable[Any], get_start: Callable[[Any], Any], get_end: Callable[[Any], Any]):
+        intervals = []
+        for position, element in enumerate(collection):
+            start, end = get_start(element), get_end(element)
+            if start is None or end is None or not start < end:
+                continue
+
+            intervals.append((start, end, position, element))
+
+        intervals.sort(key=lambda interval: interval[0])
+        self.bounds: List[Any] = sorted({bound for interval in intervals for bound in interval[:2]})
+        self.elements: List[Any] = []
+
+        active: List[Tuple[int, Any, Any]] = []
+        next_interval = 0
+        for bound in self.bounds:
+            while next_interval < len(intervals) and intervals[next_interval][0] == bound:
+                start, end, position, element = intervals[next_interval]
+                heapq.heappush(active, (position, end, element))
+                next_interval += 1
+
+            while active and not bound < active[0][1]:
+                heapq.heappop(active)
+
+            self.elements.append(active[0][2] if active else None)
+
+    def get(self, value: Any) -> Any:
+        if value is None:
+            return None
+
+        segment = bisect.bisect_right(self.bounds, value) - 1
+        if segment < 0:
+            return None
+
+        return self.elements[segment]
+
+
+def _asof_probe(base_collection: Iterable[Any], join_definition: QjoinAsofJoin) -> _Probe:
+    """
+    Returns how to find the element of the collection with the greatest key lower or equal to the key
+    of an element of the base collection.
+    """
+    get_on = _key_getter(base_collection, join_definition.on)
+    get_by = _key_getter(base_collection, join_definition.by) if join_definition.by is not None else lambda elt: None
+    index = _AsofIndex(join_definition.collection,
+                       _key_getter(join_definition.collection, join_definition.on),
+                       _key_getter(join_definition.collection, join_definition.by) if join_definition.by is not None else lambda elt: None,
+                       join_definition.tolerance)
+    return _Probe('probe', lambda position, elt: index.get(get_by(elt), get_on(elt)))
+
+
+class _AsofIndex:
+    """
+    Sorted arrays of the keys of a collection, one per ``by`` group.
+    """
+
+    def __init__(self, collection: Iterable[Any], get_on: Callable[[Any], Any], get_by: Callable[[Any], Hashable], tolerance: Optional[Any]):
+        groups: Dict[Hashable, List[Tuple[Any, Any]]] = {}
+        for element in collection:
+            on = get_on(element)
+            if on is None:
+                continue
+
+            groups.setdefault(get_by(element), []).append((on, element))
+
+        self.tolerance = tolerance
+        self.groups: Dict[Hashable, Tuple[List[Any], List[Any]]] = {}
+        for by, entries in groups.items():
+            entries.sort(key=lambda entry: entry[0])
+            self.groups[by] = ([entry[0] for entry in entries], [entry[1] for entry in entries])
+
+    def get(self, by: Hashable, on: Any) -> Any:
+        if on is None or by not in self.groups:
+            return None
+
+        keys, elements = self.groups[by]
+        position = bisect.bisect_right(keys, on) - 1
+        if position < 0:
+            return None
+
+        if self.tolerance is not None and on - keys[position] > self.tolerance:
+            return None
+
+        return elements[position]
+
+
 def _predicate_left_func_and_right_str(join_definition: QjoinJoin, elt_left: Any, elt_right: Any):
     return
@@ -1,4 +1,11 @@
+import array
+import asyncio
 import dataclasses
+import functools
+import itertools
+import operator
+import threading
+import time
 from typing import Optional
 
 import pytest
@@ -180,6 +187,34 @@ def tests_qjoin_join_request_should_perform_multiple_join_on_same_join_collectio
     assert persons_with_country_infos[0][2]['name'] == 'USA'
 
 
+def tests_qjoin_join_request_should_use_the_keys_of_each_join_on_same_join_collection():
+    """
+    tests that each join of a query uses its own keys when the same join collection is joined several times
+    """
+    # Assign
+    persons = [
+        {'name': 'Paul', 'age': 18, 'country': 'UK', 'birth_country': 'USA'},
+        {'name': 'George', 'age': 22, 'country': 'UK', 'birth_country': 'Japan'},
+    ]
+
+    countries = [
+        {'name': 'USA', 'continent': 'America'},
+        {'name': 'UK', 'continent': 'Europe'},
+        {'name': 'Japan', 'continent': 'Asia'},
+    ]
+
+    # Acts
+    persons_with_country_infos = qjoin.on(persons) \
+        .join(countries, left='country', right='name') \
+        .join(countries, left='birth_country', right='name') \
+        .all()
+
+    # Assert
+    assert persons_with_country_infos[0][1]['name'] == 'UK'
+    assert persons_with_country_infos[0][2]['name'] == 'USA'
+    assert persons_with_country_infos[1][2]['name'] == 'Japan'
+
+
 def tests_qjoin_join_joins_collection_of_object_with_collection_of_dict():
     """
     tests that the join joins 2 collections of objects
@@ -218,6 +253,7 @@ def tests_qjoin_join_joins_collection_of_object_with_collection_of_dict():
     assert spacecraft_global[4][0].name == 'Psyche'
     assert spacecraft_global[4][1] == None
 
+
 def tests_qjoin_join_joins_collection_of_tuple_with_collection_of_dict():
     """
     tests that the join joins 2 collections of objects
@@ -413,3 +449,912 @@ def tests_qjoin_join_joins_with_empty_right_collection():
     assert spacecraft_global[0][1] == None
     assert spacecraft_global[4][0].name == 'Psyche'
     assert spacecraft_global[4][1] == None
+
+
+def tests_qjoin_exists_should_keep_base_elements_with_a_match():
+    """
+    tests that exists keeps only the elements of the base collection that have a match and does not add a slot in the tuple
+    """
+    # Assign
+    spacecrafts = [
+        {'name': 'Kepler', 'cospar_id': '2009-011A', 'satcat': 34380},
+        {'name': 'GRAIL (A)', 'cospar_id': '2011-046', 'satcat': 37801},
+        {'name': 'InSight', 'cospar_id': '2018-042a', 'satcat': 43457},
+        {'name': 'lucy', 'cospar_id': '2021-093A', 'satcat': 49328},
+        {'name': 'Psyche', 'cospar_id': None, 'satcat': None},
+    ]
+
+    spacecraft_properties = [
+        {'spacecraft': 'InSight', 'dimension': (6, 1.56, 1), 'power': 600, 'launch_mass': 694},
+        {'spacecraft': 'Kepler', 'dimension': (4.7, 2.7, None), 'power': 1100, 'launch_mass': 1052.4},
+    ]
+
+    # Acts
+    spacecraft_global = qjoin.on(spacecrafts)\
+        .exists(spacecraft_properties, left='name', right='spacecraft')\
+        .all()
+
+    # Assert
+    assert spacecraft_global == [(spacecrafts[0],), (spacecrafts[2],)]
+
+
+def tests_qjoin_not_exists_should_keep_base_elements_without_match():
+    """
+    tests that not_exists keeps only the elements of the base collection that have no match and composes with join
+    """
+    # Assign
+    spacecrafts = [
+        {'name': 'Kepler', 'cospar_id': '2009-011A', 'satcat': 34380},
+        {'name': 'GRAIL (A)', 'cospar_id': '2011-046', 'satcat': 37801},
+        {'name': 'InSight', 'cospar_id': '2018-042a', 'satcat': 43457},
+        {'name': 'lucy', 'cospar_id': '2021-093A', 'satcat': 49328},
+        {'name': 'Psyche', 'cospar_id': None, 'satcat': None},
+    ]
+
+    spacecraft_properties = [
+        {'name': 'Kepler', 'dimension': (4.7, 2.7, None), 'power': 1100, 'launch_mass': 1052.4},
+        {'name': 'GRAIL (A)', 'launch_mass': 202.4},
+        {'name': 'InSight', 'dimension': (6, 1.56, 1), 'power': 600, 'launch_mass': 694},
+        {'name': 'lucy', 'dimension': (13, None, None), 'power': 504, 'launch_mass': 1550},
+    ]
+
+    retired_spacecrafts = [{'name': 'Kepler'}, {'name': 'GRAIL (A)'}]
+
+    # Acts
+    spacecraft_global = qjoin.on(spacecrafts)\
+        .join(spacecraft_properties, key='name')\
+        .not_exists(retired_spacecrafts, key=lambda s: s['name'])\
+        .all()
+
+    # Assert
+    assert len(spacecraft_global) == 3
+    assert spacecraft_global[0] == (spacecrafts[2], spacecraft_properties[2])
+    assert spacecraft_global[2] == (spacecrafts[4], None)
+    with pytest.raises(ValueError):
+        qjoin.on(spacecrafts).not_exists(retired_spacecrafts, right='name')
+
+
+def tests_qjoin_join_range_should_join_values_contained_in_intervals():
+    """
+    tests that join_range joins an element of the base collection with the first interval of the join collection that contains its value
+    """
+    # Assign
+    observations = [
+        {'spacecraft': 'Kepler', 'day': 5},
+        {'spacecraft': 'Kepler', 'day': 10},
+        {'spacecraft': 'Kepler', 'day': 17},
+        {'spacecraft': 'Kepler', 'day': 42},
+        {'spacecraft': 'Kepler', 'day': None},
+    ]
+
+    mission_phases = [
+        {'phase': 'commissioning', 'from': 0, 'to': 10},
+        {'phase': 'primary mission', 'from': 10, 'to': 30},
+        {'phase': 'safe mode', 'from': 15, 'to': 20},
+        {'phase': 'invalid', 'from': 40, 'to': 40},
+    ]
+
+    # Acts
+    observations_with_phase = qjoin.on(observations)\
+        .join_range(mission_phases, value='day', start='from', end=lambda p: p['to'])\
+        .all()
+
+    # Assert
+    assert [phase['phase'] if phase else None for _, phase in observations_with_phase] == \
+        ['commissioning', 'primary mission', 'primary mission', None, None]
+
+
+def tests_qjoin_join_range_should_return_the_first_interval_in_collection_order():
+    """
+    tests that join_range returns the first matching interval in the order of the join collection when intervals overlap
+    """
+    # Assign
+    observations = [(3,), (7,), (12,)]
+    bands = [
+        {'name': 'narrow', 'from': 6, 'to': 8},
+        {'name': 'wide', 'from': 0, 'to': 20},
+        {'name': 'other', 'from': 5, 'to': 13},
+    ]
+
+    # Acts
+    observations_with_band = qjoin.on(observations)\
+        .join_range(bands, value=0, start='from', end='to')\
+        .all()
+
+    # Assert
+    assert [band['name'] for _, band in observations_with_band] == ['wide', 'narrow', 'wide']
+
+
+def tests_qjoin_join_asof_should_join_the_nearest_preceding_key_by_group():
+    """
+    tests that join_asof joins an element of the base collection with the element of the same group that has the greatest key lower or equal to its key
+    """
+    # Assign
+    observations = [
+        {'spacecraft': 'Kepler', 'day': 12},
+        {'spacecraft': 'lucy', 'day': 12},
+        {'spacecraft': 'Kepler', 'day': 20},
+        {'spacecraft': 'Kepler', 'day': 1},
+        {'spacecraft': 'Psyche', 'day': 12},
+    ]
+
+    orbital_parameters = [
+        {'spacecraft': 'Kepler', 'day': 20, 'period': 372.6},
+        {'spacecraft': 'Kepler', 'day': 10, 'period': 372.5},
+        {'spacecraft': 'lucy', 'day': 11, 'period': 365.3},
+        {'spacecraft': 'Kepler', 'day': 10, 'period': 372.4},
+    ]
+
+    # Acts
+    latest_parameters = qjoin.on(observations)\
+        .join_asof(orbital_parameters, on='day', by='spacecraft')\
+        .all()
+
+    # Assert
+    assert [parameter['period'] if parameter else None for _, parameter in latest_parameters] == [372.4, 365.3, 372.6, None, None]
+
+
+def tests_qjoin_join_asof_should_not_join_beyond_tolerance():
+    """
+    tests that join_asof does not join elements whose keys are further apart than the tolerance
+    """
+    # Assign
+    observations = [(5,), (9,), (30,)]
+    orbital_parameters = [{'day': 0, 'period': 372.4}, {'day': 8, 'period': 372.5}]
+
+    # Acts
+    latest_parameters = qjoin.on(observations)\
+        .join_asof(orbital_parameters, on=lambda e: e[0] if isinstance(e, tuple) else e['day'], tolerance=5)\
+        .all()
+
+    # Assert
+    assert [parameter['period'] if parameter else None for _, parameter in latest_parameters] == [372.4, 372.5, None]
+
+
+def tests_qjoin_materialize_should_apply_inserts_and_deletes_on_base_collection():
+    """
+    tests that a materialized view returns the result of the query and updates it when base elements are inserted or deleted
+    """
+    # Assign
+    spacecrafts = [
+        {'name': 'Kepler', 'cospar_id': '2009-011A', 'satcat': 34380},
+        {'name': 'GRAIL (A)', 'cospar_id': '2011-046', 'satcat': 37801},
+        {'name': 'InSight', 'cospar_id': '2018-042a', 'satcat': 43457},
+    ]
+
+    spacecraft_properties = [
+        {'name': 'Kepler', 'dimension': (4.7, 2.7, None), 'power': 1100, 'launch_mass': 1052.4},
+        {'name': 'lucy', 'dimension': (13, None, None), 'power': 504, 'launch_mass': 1550},
+    ]
+
+    query = qjoin.on(spacecrafts).join(spacecraft_properties, key='name')
+    view = query.materialize()
+    events = []
+    view.on_change(lambda event, old_row, new_row: events.append((event, old_row, new_row)))
+
+    # Acts
+    lucy = {'name': 'lucy', 'cospar_id': '2021-093A', 'satcat': 49328}
+    view.insert(lucy)
+    view.delete({'name': 'GRAIL (A)', 'cospar_id': '2011-046', 'satcat': 37801})
+
+    # Assert
+    assert query.all()[0] == view.all()[0]
+    assert view.all() == [
+        (spacecrafts[0], spacecraft_properties[0]),
+        (spacecrafts[2], None),
+        (lucy, spacecraft_properties[1]),
+    ]
+    assert events == [
+        ('insert', None, (lucy, spacecraft_properties[1])),
+        ('delete', (spacecrafts[1], None), None),
+    ]
+    with pytest.raises(ValueError):
+        view.delete({'name': 'Psyche'})
+
+
+def tests_qjoin_materialize_should_update_affected_rows_on_join_collection_changes():
+    """
+    tests that a materialized view updates only the rows that share the key of an element inserted or deleted in a join collection
+    """
+    # Assign
+    persons = [
+        {'name': 'John', 'country': 'USA'},
+        {'name': 'Paul', 'country': 'UK'},
+        {'name': 'Ringo', 'country': 'UK'},
+    ]
+
+    countries = [
+        {'name': 'USA', 'continent': 'America'},
+    ]
+
+    view = qjoin.on(persons).join(countries, left='country', right='name').materialize()
+    events = []
+    view.on_change(lambda event, old_row, new_row: events.append(event))
+
+    # Acts
+    uk = {'name': 'UK', 'continent': 'Europe'}
+    united_kingdom = {'name': 'UK', 'continent': 'Europe (alias)'}
+    view.insert_join(0, uk)
+    view.insert_join(0, united_kingdom)
+    rows_after_insert = view.all()
+    view.delete_join(0, uk)
+
+    # Assert
+    assert rows_after_insert[1] == (persons[1], uk)
+    assert view.all()[1] == (persons[1], united_kingdom)
+    assert view.all()[0] == (persons[0], countries[0])
+    assert events == ['update', 'update', 'update', 'update']
+    assert countries == [{'name': 'USA', 'continent': 'America'}]
+
+
+def tests_qjoin_stream_should_join_elements_as_they_arrive_on_both_streams():
+    """
+    tests that stream joins 2 unbounded iterators and emits each couple that matches whatever the arrival order
+    """
+    # Assign
+    orders = [{'order_id': 1, 'item': 'telescope'}, {'order_id': 2, 'item': 'lander'}, {'order_id': 3, 'item': 'probe'}]
+    payments = [{'order_id': 3, 'amount': 30}, {'order_id': 1, 'amount': 10}, {'order_id': 1, 'amount': 11}]
+
+    # Acts
+    couples = list(qjoin.on(iter(orders)).join(iter(payments), key='order_id').stream())
+
+    # Assert
+    assert sorted((order['order_id'], payment['amount']) for order, payment in couples) == [(1, 10), (1, 11), (3, 30)]
+
+
+def tests_qjoin_stream_should_evict_elements_out_of_the_windows():
+    """
+    tests that stream evicts the elements waiting for a match beyond the count window and the time window
+    """
+    # Assign
+    orders_consumed = threading.Event()
+
+    def orders():
+        yield {'order_id': 1, 'time': 0}
+        yield {'order_id': 1, 'time': 1}
+        yield {'order_id': 1, 'time': 2}
+        yield {'order_id': 2, 'time': 3}
+        orders_consumed.set()
+
+    def payments():
+        orders_consumed.wait()
+        yield {'order_id': 1, 'time': 4}
+        yield {'order_id': 2, 'time': 20}
+
+    # Acts
+    couples = list(qjoin.on(orders()).join(payments(), key='order_id').stream(window=3, window_time=10, timestamp='time'))
+
+    # Assert
+    assert [(order['time'], payment['time']) for order, payment in couples] == [(1, 4), (2, 4)]
+
+
+def tests_qjoin_stream_should_require_a_single_join():
+    """
+    tests that stream refuses a query that does not declare exactly one join
+    """
+    with pytest.raises(ValueError):
+        qjoin.on(iter([])).stream()
+
+
+def tests_qjoin_stream_should_refuse_settings_that_do_not_bound_the_memory():
+    """
+    tests that stream refuses a timestamp without time window and a distinct that keeps every key seen
+    """
+    with pytest.raises(ValueError):
+        qjoin.on(iter([])).join(iter([]), key='order_id').stream(timestamp='time')
+
+    with pytest.raises(ValueError):
+        qjoin.on(iter([])).distinct(key='order_id').join(iter([]), key='order_id').stream()
+
+
+def tests_qjoin_stream_should_read_one_element_ahead_of_the_consumer():
+    """
+    tests that a stream stopped early has read only a few elements of its iterators and that its threads stop
+    """
+    # Assign
+    read_elements = [0, 0]
+
+    def orders(side):
+        for order_id in itertools.count():
+            read_elements[side] += 1
+            yield {'order_id': order_id}
+
+    threads_before = threading.active_count()
+
+    # Acts
+    stream = qjoin.on(orders(0)).join(orders(1), key='order_id').stream(window=100)
+    couples = [next(stream) for _ in range(5)]
+    stream.close()
+    time.sleep(0.5)
+
+    # Assert
+    assert len(couples) == 5
+    assert sum(read_elements) < 100
+    assert threading.active_count() == threads_before
+
+
+def tests_qjoin_index_should_be_saved_and_loaded_as_join_collection(tmp_path):
+    """
+    tests that an index saved to a file can be loaded and joined as the collection it has been built from
+    """
+    # Assign
+    spacecrafts = [
+        {'name': 'Kepler', 'cospar_id': '2009-011A', 'satcat': 34380},
+        {'name': 'GRAIL (A)', 'cospar_id': '2011-046', 'satcat': 37801},
+        {'name': 'InSight', 'cospar_id': '2018-042a', 'satcat': 43457},
+        {'name': 'lucy', 'cospar_id': '2021-093A', 'satcat': 49328},
+        {'name': 'Psyche', 'cospar_id': None, 'satcat': None},
+    ]
+
+    spacecraft_properties = [
+        {'name': 'Kepler', 'dimension': (4.7, 2.7, None), 'power': 1100, 'launch_mass': 1052.4},
+        {'name': 'GRAIL (A)', 'launch_mass': 202.4},
+        {'name': 'InSight', 'dimension': (6, 1.56, 1), 'power': 600, 'launch_mass': 694},
+        {'name': 'lucy', 'dimension': (13, None, None), 'power': 504, 'launch_mass': 1550},
+        {'name': 'lucy', 'launch_mass': 0},
+    ]
+    index_path = str(tmp_path / 'spacecraft_properties.idx')
+
+    # Acts
+    qjoin.index(spacecraft_properties, key='name').save(index_path, fingerprint='v1')
+    with qjoin.load_index(index_path, key='name', fingerprint='v1') as spacecraft_properties_index:
+        spacecraft_global = qjoin.on(spacecrafts).join(spacecraft_properties_index, left='name').all()
+
+    # Assert
+    assert spacecraft_global == qjoin.on(spacecrafts).join(spacecraft_properties, key='name').all()
+    assert spacecraft_global[3][1]['power'] == 504
+    assert spacecraft_global[4][1] is None
+
+
+def tests_qjoin_load_index_should_detect_a_stale_index(tmp_path):
+    """
+    tests that loading an index or joining on it fails when the fingerprint or the key differ from the ones of the index
+    """
+    # Assign
+    countries = [
+        {'name': 'USA', 'continent': 'America'},
+        {'name': 'UK', 'continent': 'Europe'},
+    ]
+    index_path = str(tmp_path / 'countries.idx')
+    qjoin.index(countries, key='name').save(index_path, fingerprint='v1')
+
+    # Acts & Assert
+    with pytest.raises(ValueError):
+        qjoin.load_index(index_path, fingerprint='v2')
+
+    with pytest.raises(ValueError):
+        qjoin.load_index(index_path, key='continent')
+
+    with qjoin.load_index(index_path) as countries_index:
+        with pytest.raises(ValueError):
+            qjoin.on([]).join(countries_index, left='country', right='continent')
+
+
+def tests_qjoin_load_index_should_find_keys_equal_to_the_saved_ones(tmp_path):
+    """
+    tests that a loaded index finds an element with a key equal to the saved one but built separately
+    and that keys without a stable encoding cannot be saved
+    """
+    # Assign
+    name = 'ab' + str(1)
+    observations = [
+        {'key': (name, name), 'value': 'tuple'},
+        {'key': 1, 'value': 'number'},
+    ]
+    index_path = str(tmp_path / 'observations.idx')
+
+    # Acts
+    qjoin.index(observations, key='key').save(index_path)
+
+    # Assert
+    with qjoin.load_index(index_path) as observations_index:
+        assert observations_index.get(('ab1', 'ab1'))['value'] == 'tuple'
+        assert observations_index.get(1.0)['value'] == 'number'
+        assert observations_index.get(frozenset({'ab1'})) is None
+
+    with pytest.raises(ValueError):
+        qjoin.index([{'key': frozenset({'a', 'b'})}], key='key').save(str(tmp_path / 'frozenset.idx'))
+
+
+def tests_qjoin_index_on_lambda_key_should_require_an_explicit_spec(tmp_path):
+    """
+    tests that an index built on a lambda or an itemgetter cannot be saved or checked without an explicit spec
+    """
+    # Assign
+    spacecraft_properties = [
+        {'name': 'Kepler', 'id': 1, 'power': 1100},
+        {'name': 'lucy', 'id': 2, 'power': 504},
+    ]
+    index_path = str(tmp_path / 'spacecraft_properties.idx')
+
+    # Acts & Assert
+    with pytest.raises(ValueError):
+        qjoin.index(spacecraft_properties, key=lambda s: s['name']).save(index_path)
+
+    qjoin.index(spacecraft_properties, key=lambda s: s['name'], spec='name').save(index_path)
+    with pytest.raises(ValueError):
+        qjoin.load_index(index_path, key=lambda s: s['id'])
+
+    with pytest.raises(ValueError):
+        qjoin.load_index(index_path, spec='id')
+
+    with qjoin.load_index(index_path, spec='name') as spacecraft_properties_index:
+        assert spacecraft_properties_index.get('lucy')['power'] == 504
+
+    with pytest.raises(ValueError):
+        qjoin.index(spacecraft_properties, key=operator.itemgetter('name')).save(index_path)
+
+    with pytest.raises(ValueError):
+        qjoin.load_index(index_path, key=operator.itemgetter('id'))
+
+
+def tests_qjoin_join_with_key_batch_should_compute_the_keys_of_each_collection_once():
+    """
+    tests that a batch key function is called once per collection with all its elements
+    """
+    # Assign
+    spacecrafts = [
+        {'name': 'Kepler', 'cospar_id': '2009-011A', 'satcat': 34380},
+        {'name': 'GRAIL (A)', 'cospar_id': '2011-046', 'satcat': 37801},
+        {'name': 'InSight', 'cospar_id': '2018-042a', 'satcat': 43457},
+        {'name': 'lucy', 'cospar_id': '2021-093A', 'satcat': 49328},
+        {'name': 'Psyche', 'cospar_id': None, 'satcat': None},
+    ]
+
+    spacecraft_properties = [
+        {'name': 'KEPLER', 'dimension': (4.7, 2.7, None), 'power': 1100, 'launch_mass': 1052.4},
+        {'name': 'GRAIL (A)', 'launch_mass': 202.4},
+        {'name': 'INSIGHT', 'dimension': (6, 1.56, 1), 'power': 600, 'launch_mass': 694},
+        {'name': 'Lucy', 'dimension': (13, None, None), 'power': 504, 'launch_mass': 1550},
+    ]
+
+    calls = []
+
+    def normalize_names(elements):
+        calls.append(len(elements))
+        return [element['name'].lower() for element in elements]
+
+    # Acts
+    spacecraft_global = qjoin.on(spacecrafts)\
+        .join(spacecraft_properties, key_batch=normalize_names)\
+        .all()
+
+    # Assert
+    assert calls == [4, 5]
+    assert spacecraft_global[0] == (spacecrafts[0], spacecraft_properties[0])
+    assert spacecraft_global[3] == (spacecrafts[3], spacecraft_properties[3])
+    assert spacecraft_global[4] == (spacecrafts[4], None)
+
+
+def tests_qjoin_join_with_left_batch_should_be_combined_with_right_key():
+    """
+    tests that a batch key function on the base collection can be combined with a simple key on the join collection
+    and that both forms of a key cannot be given together
+    """
+    # Assign
+    persons = [
+        {'name': 'John', 'country': 'usa'},
+        {'name': 'Paul', 'country': 'uk'},
+    ]
+
+    countries = [
+        {'name': 'USA', 'continent': 'America'},
+        {'name': 'UK', 'continent': 'Europe'},
+    ]
+
+    # Acts
+    persons_with_country = qjoin.on(persons)\
+        .join(countries, left_batch=lambda persons: [p['country'].upper() for p in persons], right='name')\
+        .all()
+
+    # Assert
+    assert persons_with_country[1] == (persons[1], countries[1])
+    with pytest.raises(ValueError):
+        qjoin.on(persons).join(countries, left='country', left_batch=lambda persons: [], right='name')
+
+    with pytest.raises(ValueError):
+        qjoin.on(persons).join(countries, left_batch=functools.partial(lambda prefix, persons: [prefix], 'USA'), right='name').all()
+
+
+def tests_qjoin_columns_should_join_column_collections_as_row_views():
+    """
+    tests that a collection stored column by column can be used as base collection and as join collection
+    and that its rows are returned as views on the columns
+    """
+    # Assign
+    spacecrafts = qjoin.columns({
+        'name': ['Kepler', 'GRAIL (A)', 'InSight', 'lucy', 'Psyche'],
+        'satcat': array.array('i', [34380, 37801, 43457, 49328, 0]),
+    })
+
+    spacecraft_properties = qjoin.columns({
+        'name': ['Kepler', 'InSight', 'lucy'],
+        'power': [1100, 600, 504],
+    })
+
+    # Acts
+    spacecraft_global = qjoin.on(spacecrafts)\
+        .join(spacecraft_properties, key='name')\
+        .all()
+
+    # Assert
+    assert len(spacecraft_global) == 5
+    assert isinstance(spacecraft_global[0][0], qjoin.QjoinRow)
+    assert spacecraft_global[0][0] == {'name': 'Kepler', 'satcat': 34380}
+    assert spacecraft_global[2][1]['power'] == 600
+    assert spacecraft_global[1][1] is None
+
+
+def tests_qjoin_columns_should_join_with_collection_of_dict():
+    """
+    tests that a collection stored column by column can be joined with a collection of dictionaries on a function key
+    and that columns of different lengths are refused
+    """
+    # Assign
+    persons = [
+        {'name': 'John', 'country': 'usa'},
+        {'name': 'Paul', 'country': 'uk'},
+    ]
+
+    countries = qjoin.columns({'name': ['USA', 'UK'], 'continent': ['America', 'Europe']})
+
+    # Acts
+    persons_with_country = qjoin.on(persons)\
+        .join(countries, left=lambda p: p['country'].upper(), right='name')\
+        .all()
+
+    # Assert
+    assert persons_with_country[1][1]['continent'] == 'Europe'
+    with pytest.raises(ValueError):
+        qjoin.columns({'name': ['USA', 'UK'], 'continent': ['America']})
+
+
+def tests_qjoin_distinct_should_drop_duplicates_of_base_and_join_collections():
+    """
+    tests that distinct removes the duplicates of the base collection and of the collection of the last join
+    """
+    # Assign
+    spacecrafts = [
+        {'name': 'Kepler', 'cospar_id': '2009-011A', 'satcat': 34380},
+        {'name': 'lucy', 'cospar_id': '2021-093A', 'satcat': 49328},
+        {'name': 'Kepler', 'cospar_id': '2009-011A', 'satcat': 34380},
+        {'name': 'lucy', 'cospar_id': '2021-093A', 'satcat': None},
+    ]
+
+    spacecraft_properties = [
+        {'name': 'Kepler', 'power': 1000},
+        {'name': 'lucy', 'power': 504},
+        {'name': 'Kepler', 'power': 1100},
+    ]
+
+    # Acts
+    first_spacecrafts = qjoin.on(spacecrafts)\
+        .distinct(key='name')\
+        .join(spacecraft_properties, key='name')\
+        .distinct(key='name', keep='last')\
+        .all()
+
+    last_spacecrafts = qjoin.on(spacecrafts)\
+        .distinct(key=lambda s: s['name'], keep='last')\
+        .all()
+
+    # Assert
+    assert first_spacecrafts == [
+        (spacecrafts[0], spacecraft_properties[2]),
+        (spacecrafts[1], spacecraft_properties[1]),
+    ]
+    assert last_spacecrafts == [(spacecrafts[2],), (spacecrafts[3],)]
+
+
+def tests_qjoin_distinct_should_use_a_bloom_filter_with_a_false_positive_rate():
+    """
+    tests that distinct keeps the keys in a bloom filter when a false positive rate is given
+    and refuses a false positive rate with keep="last"
+    """
+    # Assign
+    events = [{'id': i % 500} for i in range(2000)]
+
+    # Acts
+    distinct_events = qjoin.on(events)\
+        .distinct(key='id', false_positive_rate=0.001, capacity=500)\
+        .all()
+
+    # Assert
+    assert 490 <= len(distinct_events) <= 500
+    assert len({event['id'] for event, in distinct_events}) == len(distinct_events)
+    with pytest.raises(ValueError):
+        qjoin.on(events).distinct(key='id', keep='last', false_positive_rate=0.01, capacity=500)
+
+    with pytest.raises(ValueError):
+        qjoin.on(events).distinct(key='id', capacity=500)
+
+
+def tests_qjoin_as_graph_should_create_one_aggregate_per_parent_with_its_children():
+    """
+    tests that as_graph creates a single aggregate per join element and attaches the base elements as its children
+    """
+    # Assign
+    @dataclasses.dataclass
+    class Spacecraft:
+        spacecraft: dict = dataclasses.field(init=False)
+        missions: list = dataclasses.field(init=False)
+        mission_count: int = dataclasses.field(init=False)
+
+        def __post_qjoin__(self):
+            self.mission_count = len(self.missions)
+
+    spacecrafts = [
+        {'name': 'Kepler', 'cospar_id': '2009-011A', 'satcat': 34380},
+        {'name': 'lucy', 'cospar_id': '2021-093A', 'satcat': 49328},
+    ]
+
+    missions = [
+        {'mission': 'Kepler primary mission', 'spacecraft': 'Kepler'},
+        {'mission': 'Lucy', 'spacecraft': 'lucy'},
+        {'mission': 'K2', 'spacecraft': 'Kepler'},
+        {'mission': 'Psyche', 'spacecraft': 'Psyche'},
+    ]
+
+    # Acts
+    spacecraft_graph = qjoin.on(missions)\
+        .join(spacecrafts, left='spacecraft', right='name')\
+        .as_graph(Spacecraft, parent='spacecraft', children='missions')
+
+    # Assert
+    assert len(spacecraft_graph) == 2
+    assert spacecraft_graph[0].spacecraft is spacecrafts[0]
+    assert spacecraft_graph[0].missions == [missions[0], missions[2]]
+    assert spacecraft_graph[0].mission_count == 2
+    assert spacecraft_graph[1].missions == [missions[1]]
+
+
+def tests_qjoin_as_graph_should_identify_parents_by_key():
+    """
+    tests that as_graph identifies the parents with the key of their join by default, or with the given key,
+    when equal parents are distinct objects
+    """
+    # Assign
+    @dataclasses.dataclass
+    class Country:
+        country: dict = dataclasses.field(init=False)
+        persons: list = dataclasses.field(init=False)
+
+    persons = [
+        {'name': 'John', 'country': 'USA'},
+        {'name': 'Paul', 'country': 'UK'},
+        {'name': 'Ringo', 'country': 'UK'},
+    ]
+
+    countries = qjoin.columns({'name': ['USA', 'UK'], 'continent': ['America', 'Europe']})
+
+    # Acts
+    country_graph = qjoin.on(persons)\
+        .join(countries, left='country', right='name')\
+        .as_graph(Country, parent='country', children='persons')
+
+    continent_graph = qjoin.on(persons)\
+        .join(countries, left='country', right='name')\
+        .as_graph(Country, parent='country', children='persons', key=lambda country: 'Earth')
+
+    # Assert
+    assert len(country_graph) == 2
+    assert [person['name'] for person in country_graph[1].persons] == ['Paul', 'Ringo']
+    assert len(continent_graph) == 1
+
+
+def tests_qjoin_query_mixing_filters_and_join_kinds_should_be_iterable_several_times():
+    """
+    tests that a query combining distinct, filters and different kinds of joins returns the same result each time it is iterated
+    """
+    # Assign
+    @dataclasses.dataclass
+    class Observation:
+        spacecraft: str
+        day: int
+
+    observations = [
+        Observation('Kepler', 12),
+        Observation('Kepler', 12),
+        Observation('lucy', 3),
+        Observation('Psyche', 5),
+    ]
+
+    spacecrafts = [
+        {'name': 'Kepler', 'cospar_id': '2009-011A', 'satcat': 34380},
+        {'name': 'lucy', 'cospar_id': '2021-093A', 'satcat': 49328},
+    ]
+
+    mission_phases = [{'phase': 'commissioning', 'from': 0, 'to': 10}, {'phase': 'science', 'from': 10, 'to': 30}]
+
+    query = qjoin.on(observations)\
+        .distinct(key=lambda o: (o.spacecraft, o.day))\
+        .exists(spacecrafts, left='spacecraft', right='name')\
+        .join(spacecrafts, left='spacecraft', right='name')\
+        .join_range(mission_phases, value='day', start='from', end='to')\
+        .join(spacecrafts, left_batch=lambda observations: [o.spacecraft.upper() for o in observations], right=lambda s: s['name'].upper())
+
+    # Acts
+    first_result = query.all()
+    second_result = query.all()
+
+    # Assert
+    assert first_result == second_result
+    assert first_result == [
+        (observations[0], spacecrafts[0], mission_phases[1], spacecrafts[0]),
+        (observations[2], spacecrafts[1], mission_phases[0], spacecrafts[1]),
+    ]
+
+
+def tests_qjoin_join_should_read_every_element_of_a_generator():
+    """
+    tests that the first element of a one-shot iterator is not lost when qjoin looks at it to read the keys
+    """
+    # Assign
+    spacecrafts = [
+        {'name': 'Kepler', 'cospar_id': '2009-011A'},
+        {'name': 'GRAIL (A)', 'cospar_id': '2011-046'},
+        {'name': 'InSight', 'cospar_id': '2018-042A'},
+    ]
+    spacecraft_properties = [
+        {'name': 'Kepler', 'power': 1100},
+        {'name': 'GRAIL (A)', 'power': 0},
+        {'name': 'InSight', 'power': 600},
+    ]
+
+    # Acts
+    result = qjoin.on(spacecraft for spacecraft in spacecrafts) \
+        .join((spacecraft_property for spacecraft_property in spacecraft_properties), key='name') \
+        .all()
+
+    # Assert
+    assert [(spacecraft['name'], spacecraft_property['power']) for spacecraft, spacecraft_property in result] == [('Kepler', 1100), ('GRAIL (A)', 0), ('InSight', 600)]
+
+
+def tests_qjoin_join_lookup_should_fetch_deduplicated_keys_by_batches():
+    """
+    tests that join_lookup fetches each distinct key once, by batches, and keeps the fetched elements in cache between iterations
+    """
+    # Assign
+    persons = [
+        {'name': 'John', 'country': 'USA'},
+        {'name': 'Paul', 'country': 'UK'},
+        {'name': 'Ringo', 'country': 'UK'},
+        {'name': 'George', 'country': 'Japan'},
+        {'name': 'Yoko', 'country': 'France'},
+        {'name': 'Brian', 'country': None},
+    ]
+
+    countries = {
+        'USA': {'name': 'USA', 'continent': 'America'},
+        'UK': {'name': 'UK', 'continent': 'Europe'},
+        'Japan': {'name': 'Japan', 'continent': 'Asia'},
+    }
+
+    batches = []
+
+    def fetch_countries(names):
+        batches.append(list(names))
+        return {name: countries[name] for name in names if name in countries}
+
+    query = qjoin.on(persons).join_lookup(fetch_countries, left='country', batch_size=2, concurrency=2)
+
+    # Acts
+    persons_with_country = query.all()
+    persons_with_country_again = query.all()
+
+    # Assert
+    assert sorted(batches) == [['Japan', 'France'], ['USA', 'UK']]
+    assert persons_with_country == persons_with_country_again
+    assert persons_with_country[2] == (persons[2], countries['UK'])
+    assert persons_with_country[4] == (persons[4], None)
+    assert persons_with_country[5] == (persons[5], None)
+
+
+def tests_qjoin_join_lookup_should_fetch_only_the_keys_kept_by_distinct_and_filters():
+    """
+    tests that join_lookup does not fetch the keys of the base elements dropped by distinct, exists or not_exists
+    """
+    # Assign
+    persons = [
+        {'name': 'John', 'country': 'USA'},
+        {'name': 'John', 'country': 'Canada'},
+        {'name': 'Paul', 'country': 'UK'},
+        {'name': 'Yoko', 'country': 'Japan'},
+    ]
+    musicians = [{'name': 'John'}, {'name': 'Paul'}, {'name': 'Yoko'}]
+    retired = [{'name': 'Yoko'}]
+
+    fetched_keys = []
+
+    def fetch_countries(names):
+        fetched_keys.extend(names)
+        return {name: {'name': name} for name in names}
+
+    # Acts
+    persons_with_country = qjoin.on(persons)\
+        .distinct(key='name')\
+        .exists(musicians, key='name')\
+        .not_exists(retired, key='name')\
+        .join_lookup(fetch_countries, left='country')\
+        .all()
+
+    # Assert
+    assert sorted(fetched_keys) == ['UK', 'USA']
+    assert persons_with_country == [(persons[0], {'name': 'USA'}), (persons[2], {'name': 'UK'})]
+
+
+def tests_qjoin_join_lookup_should_accept_coroutine_fetching_a_list_of_elements():
+    """
+    tests that join_lookup runs a coroutine function and matches a list of elements with the keys in order
+    """
+    # Assign
+    spacecrafts = [
+        {'name': 'Kepler', 'cospar_id': '2009-011A', 'satcat': 34380},
+        {'name': 'lucy', 'cospar_id': '2021-093A', 'satcat': 49328},
+    ]
+
+    async def fetch_properties(names):
+        return [{'name': name, 'power': len(name)} for name in names]
+
+    # Acts
+    spacecraft_global = qjoin.on(spacecrafts)\
+        .join_lookup(fetch_properties, left=lambda s: s['name'], batch_size=1, concurrency=2, cache_size=0)\
+        .all()
+
+    # Assert
+    assert spacecraft_global[0][1] == {'name': 'Kepler', 'power': 6}
+    assert spacecraft_global[1][1] == {'name': 'lucy', 'power': 4}
+
+
+def tests_qjoin_join_lookup_should_refuse_coroutine_inside_a_running_event_loop():
+    """
+    tests that join_lookup refuses to block a running event loop with a coroutine function and runs it from a thread
+    """
+    # Assign
+    spacecrafts = [
+        {'name': 'Kepler', 'cospar_id': '2009-011A', 'satcat': 34380},
+        {'name': 'lucy', 'cospar_id': '2021-093A', 'satcat': 49328},
+    ]
+
+    async def fetch_properties(names):
+        return {name: {'name': name, 'power': len(name)} for name in names}
+
+    query = qjoin.on(spacecrafts).join_lookup(fetch_properties, left='name')
+
+    async def iterate_in_loop():
+        return query.all()
+
+    async def iterate_in_thread():
+        return await asyncio.get_running_loop().run_in_executor(None, query.all)
+
+    # Acts
+    spacecraft_global = asyncio.run(iterate_in_thread())
+
+    # Assert
+    assert spacecraft_global[1][1] == {'name': 'lucy', 'power': 4}
+    with pytest.raises(ValueError):
+        asyncio.run(iterate_in_loop())
+
+
+def tests_qjoin_join_lookup_should_accept_a_generator_of_elements():
+    """
+    tests that join_lookup matches the elements yielded by a generator with the keys in order
+    """
+    # Assign
+    spacecrafts = [
+        {'name': 'Kepler', 'cospar_id': '2009-011A', 'satcat': 34380},
+        {'name': 'lucy', 'cospar_id': '2021-093A', 'satcat': 49328},
+    ]
+
+    def fetch_properties(names):
+        for name in names:
+            yield {'name': name, 'power': len(name)}
+
+    # Acts
+    spacecraft_global = qjoin.on(spacecrafts).join_lookup(fetch_properties, left='name').all()
+
+    # Assert
+    assert spacecraft_global[0][1] == {'name': 'Kepler', 'power': 6}
+    assert spacecraft_global[1][1] == {'name': 'lucy', 'power': 4}
+    with pytest.raises(ValueError):
+        qjoin.on(spacecrafts).join_lookup(functools.partial(lambda power, names: [power], 0), left='name').all()